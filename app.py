@@ -6,12 +6,19 @@ French B2 Dynamic Exercise Book — Édito B2
 from __future__ import annotations
 
 import json
+import time
 from pathlib import Path
 
 import streamlit as st
 
+from lib.grading import llm_cache_stats
+from lib.history import ScoreHistory
+from lib.persistence import save_status, wait_saved
+from lib.progress import ProgressStats, WeakPointStore
+from lib.search import SearchIndex, build_search_index
+from lib.session_budget import enforce_budget, process_report
 from lib.state import init_state, reset_unit_state
-from lib.storage import load_saved_progress
+from lib.storage import load_saved_progress, normalize_user_id
 
 # ---------------------------------------------------------------------------
 # 配置
@@ -480,23 +487,18 @@ def load_data() -> list[dict]:
         return json.load(f)
 
 
+@st.cache_resource
+def load_search_index() -> SearchIndex:
+    """语料倒排索引 — 进程内只构建一次，所有会话共享。"""
+    return build_search_index(load_data())
+
+
 # ---------------------------------------------------------------------------
-# Session State + 持久化恢复
+# Session State
 # ---------------------------------------------------------------------------
 init_state()
 units = load_data()
 
-# 从持久化存储恢复进度（仅首次加载）
-if "progress_loaded" not in st.session_state:
-    saved = load_saved_progress()
-    if saved["scores"]:
-        # JSON key 是字符串，转回 int
-        st.session_state.scores = {int(k): v for k, v in saved["scores"].items()}
-    if saved["weak_points"]:
-        st.session_state.weak_points = saved["weak_points"]
-    st.session_state.progress_loaded = True
-
-
 # ---------------------------------------------------------------------------
 # 密码验证
 # ---------------------------------------------------------------------------
@@ -515,16 +517,48 @@ if not st.session_state.authenticated:
     """, unsafe_allow_html=True)
     _spacer_l, _login_col, _spacer_r = st.columns([1, 1, 1])
     with _login_col:
+        _name = st.text_input("Prénom", placeholder="Votre prénom (facultatif)")
         _pwd = st.text_input("Mot de passe", type="password", placeholder="Entrez le mot de passe")
         if st.button("Connexion", type="primary", use_container_width=True):
             if _pwd == APP_PASSWORD:
                 st.session_state.authenticated = True
+                st.session_state.user_id = normalize_user_id(_name)
                 st.rerun()
             else:
                 st.error("Mot de passe incorrect.")
     st.stop()
 
 
+# ---------------------------------------------------------------------------
+# 进度恢复 — 登录后按用户懒加载，仅读取该用户自己的记录
+# ---------------------------------------------------------------------------
+if "progress_loaded" not in st.session_state:
+    wait_saved(st.session_state.user_id, timeout=5)   # 同一用户在其他会话中尚未落盘的保存
+    saved = load_saved_progress(st.session_state.user_id)
+    legacy = {int(k): v for k, v in saved["scores"].items()}  # JSON key 是字符串，转回 int
+    if saved["history"]:
+        st.session_state.score_history = ScoreHistory.from_dict(saved["history"])
+    elif legacy:
+        # 旧版 {unit: [pct, ...]} → 有界历史
+        st.session_state.score_history = ScoreHistory.from_scores(legacy)
+    stats = saved["stats"]
+    if stats and stats.get("count") == st.session_state.score_history.count:
+        st.session_state.progress_stats = ProgressStats.from_dict(stats)
+    elif legacy:
+        # 旧数据无聚合（或与历史不一致）→ 重建一次
+        st.session_state.progress_stats = ProgressStats.from_scores(legacy)
+    if saved["weak_points"]:
+        st.session_state.weak_points = WeakPointStore(saved["weak_points"])
+    st.session_state.exams = list(saved["exams"])
+    st.session_state.progress_loaded = True
+
+
+# ---------------------------------------------------------------------------
+# 内存预算：回填当前页面数据，溢出其他页面的冷数据
+# ---------------------------------------------------------------------------
+_mem = enforce_budget(st.session_state.current_page)
+
+
 # ---------------------------------------------------------------------------
 # 侧边栏导航
 # ---------------------------------------------------------------------------
@@ -540,13 +574,16 @@ with st.sidebar:
     if st.button("Examen Blanc B2", key="sb_exam_blanc", use_container_width=True):
         st.session_state.current_page = "exam_blanc"
         st.rerun()
+    if st.button("Recherche", key="sb_search", use_container_width=True):
+        st.session_state.current_page = "search"
+        st.rerun()
 
     st.caption("UNITÉS")
     for _u in units:
         _n = _u["unit_number"]
         _score_marker = ""
-        if _n in st.session_state.scores:
-            _best = max(st.session_state.scores[_n])
+        _best = st.session_state.progress_stats.best(_n)
+        if _best is not None:
             _score_marker = f" · {_best}%"
         _label = f"Unité {_n}: {_u['theme']}{_score_marker}"
         if st.button(_label, key=f"sb_unit_{_n}", use_container_width=True):
@@ -563,6 +600,27 @@ with st.sidebar:
         st.success("API Key ✓", icon="🔑")
     else:
         st.warning("需要 API Key", icon="⚠️")
+    _proc = process_report()
+    _spilled = f" · {len(_mem['spilled'])} sur disque" if _mem["spilled"] else ""
+    st.caption(
+        f"Mémoire : {_mem['total'] // 1024} Ko / {_mem['budget'] // 1024} Ko{_spilled}"
+        f" · {_proc['sessions']} session(s), {_proc['total'] / 1048576:.1f} Mo"
+    )
+    _llm = llm_cache_stats()
+    if _llm["hits"] + _llm["misses"]:
+        st.caption(
+            f"Cache IA : {_llm['hits']}/{_llm['hits'] + _llm['misses']} "
+            f"({_llm['hit_rate']:.0%}) · {_llm['bytes_saved'] // 1024} Ko économisés"
+        )
+    _save = save_status(st.session_state.user_id)
+    if _save["state"] in ("pending", "saving"):
+        st.caption("Sauvegarde en cours…")
+    elif _save["state"] == "retrying":
+        st.caption(f"Sauvegarde : nouvelle tentative ({_save['attempts']})…")
+    elif _save["state"] == "failed":
+        st.warning(f"Progrès non sauvegardé : {_save['error']}", icon="⚠️")
+    elif _save["saved_at"]:
+        st.caption(f"Progrès sauvegardé à {time.strftime('%H:%M:%S', time.localtime(_save['saved_at']))}")
 
 
 # ---------------------------------------------------------------------------
@@ -581,6 +639,7 @@ from views.home import render_home  # noqa: E402
 from views.unit import render_unit  # noqa: E402
 from views.progress import render_progress  # noqa: E402
 from views.exam_blanc import render_exam_blanc  # noqa: E402
+from views.search import render_search  # noqa: E402
 
 page = st.session_state.current_page
 
@@ -590,5 +649,7 @@ elif page == "progress":
     render_progress()
 elif page == "exam_blanc":
     render_exam_blanc(units)
+elif page == "search":
+    render_search(units, load_search_index())
 else:
     render_home(units)
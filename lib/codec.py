@@ -0,0 +1,196 @@
+"""
+进度文档编码 — 带版本的紧凑二进制格式（列存储 + 语料引用 + 压缩）。
+
+格式：b"VFP" + 版本字节 + 压缩方式字节（z=zstd, g=gzip, n=无）+ 负载
+负载为紧凑 JSON（无缩进）：
+- history / stats 原样（ScoreHistory 本身已是列存储）
+- weak_points 按列存储，类型用下标表，题面能由语料重建时只存候选下标
+- exams 按列存储，缺失字段为 null
+- applied（已应用事件 id）打包为原始字节的 base64 串
+旧版明文 JSON（以 "{" 开头）照常读取，下次保存时自动升级。
+zstd 需要可选依赖 zstandard，未安装时用 gzip；其余只依赖标准库。
+"""
+
+from __future__ import annotations
+
+import base64
+import gzip
+import json
+import os
+import zlib
+from functools import lru_cache
+from pathlib import Path
+
+from lib.progress import EVENT_ID_BYTES
+from lib.quiz import weak_item_texts
+
+MAGIC = b"VFP"
+VERSION = 2
+
+_DATA_PATH = Path(__file__).resolve().parent.parent / "data.json"
+
+try:
+    import zstandard
+except ImportError:    # 可选依赖
+    zstandard = None
+
+_ZSTD_ERRORS = (zstandard.ZstdError,) if zstandard else ()
+
+
+def _default_codec() -> str:
+    codec = os.environ.get("PROGRESS_CODEC", "zstd")
+    if codec == "zstd" and zstandard is None:
+        return "gzip"
+    return codec
+
+
+CODEC = _default_codec()      # "zstd" | "gzip" | "json"（明文，便于调试）
+
+
+class ProgressDecodeError(ValueError):
+    """进度数据已损坏（截断 / 解压失败 / JSON 无效）。"""
+
+
+# ---------------------------------------------------------------------------
+# 语料引用
+# ---------------------------------------------------------------------------
+@lru_cache(maxsize=1)
+def _corpus_texts() -> dict[tuple[str, int, str], tuple[str, ...]]:
+    """{(type, unit, key): 候选题面}，从 data.json 构建一次。"""
+    try:
+        with open(_DATA_PATH, "r", encoding="utf-8") as f:
+            units = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return {
+        (wp_type, u["unit_number"], key): texts
+        for u in units
+        for (wp_type, key), texts in weak_item_texts(u).items()
+    }
+
+
+# ---------------------------------------------------------------------------
+# 列存储
+# ---------------------------------------------------------------------------
+def _pack_weak_points(weak_points: list[dict]) -> dict:
+    corpus = _corpus_texts()
+    types: list[str] = []
+    type_idx: dict[str, int] = {}
+    cols: dict[str, list] = {"type": [], "unit": [], "key": [], "fail_count": [], "item": []}
+    for wp in weak_points:
+        t, u, k = wp.get("type", ""), wp.get("unit", 0), wp.get("key", "")
+        if t not in type_idx:
+            type_idx[t] = len(types)
+            types.append(t)
+        item = wp.get("item", "")
+        candidates = corpus.get((t, u, k), ())
+        cols["type"].append(type_idx[t])
+        cols["unit"].append(u)
+        cols["key"].append(k)
+        cols["fail_count"].append(wp.get("fail_count", 1))
+        # 能由语料重建的题面只存候选下标，否则原文保留
+        cols["item"].append(candidates.index(item) if item in candidates else item)
+    return {"types": types, **cols}
+
+
+def _unpack_weak_points(packed: dict) -> list[dict]:
+    corpus = _corpus_texts()
+    types = packed["types"]
+    out = []
+    for t, u, k, fc, item in zip(
+        packed["type"], packed["unit"], packed["key"], packed["fail_count"], packed["item"],
+    ):
+        wp_type = types[t]
+        if isinstance(item, int):
+            candidates = corpus.get((wp_type, u, k), ())
+            # 语料已删除该条目时退回 key 本身作为题面
+            item = candidates[item] if item < len(candidates) else k
+        out.append({"type": wp_type, "unit": u, "key": k, "item": item, "fail_count": fc})
+    return out
+
+
+def _pack_rows(rows: list[dict]) -> dict:
+    fields: list[str] = []
+    for row in rows:
+        fields.extend(f for f in row if f not in fields)
+    return {f: [row.get(f) for row in rows] for f in fields}
+
+
+def _unpack_rows(cols: dict) -> list[dict]:
+    n = len(next(iter(cols.values()), []))
+    return [
+        {f: col[i] for f, col in cols.items() if col[i] is not None}
+        for i in range(n)
+    ]
+
+
+def _pack_ids(ids: list[str]) -> str | list[str]:
+    """8 位十六进制 id → 拼接字节的 base64（JSON 里每个 id 约 5.3 字节而非 11）；格式不符时原样保留。"""
+    try:
+        raw = b"".join(bytes.fromhex(i) for i in ids)
+    except (TypeError, ValueError):
+        return ids
+    if len(raw) != len(ids) * EVENT_ID_BYTES:
+        return ids
+    return base64.b64encode(raw).decode("ascii")
+
+
+def _unpack_ids(packed: str | list[str]) -> list[str]:
+    if isinstance(packed, list):
+        return packed
+    raw = base64.b64decode(packed)
+    return [raw[i:i + EVENT_ID_BYTES].hex() for i in range(0, len(raw), EVENT_ID_BYTES)]
+
+
+# ---------------------------------------------------------------------------
+# 编码 / 解码
+# ---------------------------------------------------------------------------
+def encode_progress(data: dict, codec: str | None = None) -> bytes:
+    """进度文档 → 字节。"""
+    codec = codec or CODEC
+    doc = dict(data)
+    if "weak_points" in doc:
+        doc["weak_points"] = _pack_weak_points(doc["weak_points"])
+    if "exams" in doc:
+        doc["exams"] = _pack_rows(doc["exams"])
+    if "applied" in doc:
+        doc["applied"] = _pack_ids(doc["applied"])
+    payload = json.dumps(doc, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if codec == "json":
+        return MAGIC + bytes([VERSION]) + b"n" + payload
+    if codec == "zstd":
+        return MAGIC + bytes([VERSION]) + b"z" + zstandard.ZstdCompressor(level=3).compress(payload)
+    return MAGIC + bytes([VERSION]) + b"g" + gzip.compress(payload, compresslevel=6, mtime=0)
+
+
+def decode_progress(raw: bytes) -> dict:
+    """字节 → 进度文档；兼容旧版明文 JSON。"""
+    if not raw.startswith(MAGIC):
+        # 旧版：indent=2 的明文 JSON
+        try:
+            return json.loads(raw)
+        except ValueError as e:
+            raise ProgressDecodeError(str(e)) from e
+    version, method, body = raw[3:4], raw[4:5], raw[5:]
+    if version != bytes([VERSION]):
+        # 更新版本写入的数据：不能当作损坏处理
+        raise RuntimeError(f"未知的进度格式版本：{version!r}")
+    if method == b"z" and zstandard is None:
+        raise RuntimeError("进度数据为 zstd 压缩，需要安装 zstandard")
+    try:
+        if method == b"z":
+            body = zstandard.ZstdDecompressor().decompress(body)
+        elif method == b"g":
+            body = gzip.decompress(body)
+        elif method != b"n":
+            raise ProgressDecodeError(f"未知的压缩方式：{method!r}")
+        doc = json.loads(body)
+    except (ValueError, OSError, EOFError, zlib.error, *_ZSTD_ERRORS) as e:
+        raise ProgressDecodeError(str(e)) from e
+    if "weak_points" in doc:
+        doc["weak_points"] = _unpack_weak_points(doc["weak_points"])
+    if "exams" in doc:
+        doc["exams"] = _unpack_rows(doc["exams"])
+    if "applied" in doc:
+        doc["applied"] = _unpack_ids(doc["applied"])
+    return doc
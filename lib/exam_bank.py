@@ -0,0 +1,243 @@
+"""
+CO / CE 模考题库 — 按单元预生成、校验并落盘，全体用户共享，点击「Générer」即时出题。
+
+- 题目：data/exam_bank/<unit>/<kind>/<id>.json，CO 另有已合成的 <id>.mp3
+- 发放记录：data/exam_bank/served/<shard>/<user_id>.json，同一学习者不会拿到做过的题
+- 后台线程补货：学习者取走一份题后，保证其在该单元还有 TARGET_DEPTH 份没做过的题；
+  费用由服务端的 EXAM_BANK_API_KEY 承担，未配置时不补货（从不动用学习者自己的 Key）
+- 每个单元 / 类型最多保留 BANK_MAX 份，超出时淘汰最旧的
+- prepare_exam：一次准备整套 CO + CE，各步骤并发（asyncio），耗时约等于最慢的一步
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import threading
+from pathlib import Path
+
+from lib.grading import bank_api_key, build_exam, build_exam_async, validate_exam
+from lib.storage import DATA_DIR, atomic_write_bytes, atomic_write_text, user_shard
+from lib.tts import synthesize_french, synthesize_french_async
+
+BANK_DIR = Path(os.environ.get("EXAM_BANK_DIR", DATA_DIR / "exam_bank"))
+TARGET_DEPTH = int(os.environ.get("EXAM_BANK_TARGET", "3"))
+BANK_MAX = int(os.environ.get("EXAM_BANK_MAX", "30"))
+MAX_FAILURES = 3               # 单次补货连续失败（API 错误 / 结构不合格）上限
+KINDS = ("co", "ce")
+
+_lock = threading.Lock()
+_requests: queue.Queue = queue.Queue(maxsize=64)
+_pending: set[tuple[int, str, str]] = set()        # 已排队的 (unit, kind, user_id)，去重
+_worker: threading.Thread | None = None
+_stats = {"served": 0, "misses": 0, "generated": 0, "failures": 0, "evicted": 0}
+
+
+# ---------------------------------------------------------------------------
+# 磁盘布局
+# ---------------------------------------------------------------------------
+def _kind_dir(unit_number: int, kind: str) -> Path:
+    return BANK_DIR / str(unit_number) / kind
+
+
+def _served_path(user_id: str) -> Path:
+    return BANK_DIR / "served" / user_shard(user_id) / f"{user_id}.json"
+
+
+def _exam_ids(unit_number: int, kind: str) -> list[str]:
+    """该单元 / 类型的全部题目 id，从旧到新。"""
+    paths = list(_kind_dir(unit_number, kind).glob("*.json"))
+    paths.sort(key=lambda p: p.stat().st_mtime)
+    return [p.stem for p in paths]
+
+
+def _load_served(user_id: str) -> set[str]:
+    try:
+        return set(json.loads(_served_path(user_id).read_text(encoding="utf-8")))
+    except (OSError, json.JSONDecodeError):
+        return set()
+
+
+def _save_served(user_id: str, served: set[str]) -> None:
+    atomic_write_text(_served_path(user_id), json.dumps(sorted(served)))
+
+
+def _unseen(unit_number: int, kind: str, user_id: str) -> list[str]:
+    served = _load_served(user_id)
+    return [i for i in _exam_ids(unit_number, kind) if f"{unit_number}/{kind}/{i}" not in served]
+
+
+# ---------------------------------------------------------------------------
+# 存取
+# ---------------------------------------------------------------------------
+def add(
+    unit_number: int,
+    kind: str,
+    data: dict,
+    audio: bytes | None = None,
+    served_to: str | None = None,
+) -> str | None:
+    """存入一份题目（可同时记为已发放给 served_to），返回 id；结构不合格的题不入库。"""
+    if validate_exam(kind, data):
+        return None
+    text = json.dumps(data, ensure_ascii=False)
+    exam_id = hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+    d = _kind_dir(unit_number, kind)
+    with _lock:
+        if audio:
+            atomic_write_bytes(d / f"{exam_id}.mp3", audio)
+        atomic_write_text(d / f"{exam_id}.json", text)
+        if served_to is not None:
+            served = _load_served(served_to)
+            served.add(f"{unit_number}/{kind}/{exam_id}")
+            _save_served(served_to, served)
+        ids = _exam_ids(unit_number, kind)
+        for old in ids[:max(0, len(ids) - BANK_MAX)]:
+            (d / f"{old}.json").unlink(missing_ok=True)
+            (d / f"{old}.mp3").unlink(missing_ok=True)
+            _stats["evicted"] += 1
+    return exam_id
+
+
+def take(unit_number: int, kind: str, user_id: str) -> tuple[dict, bytes | None] | None:
+    """取出一份该学习者没做过的题（最旧的优先）并记为已发放；题库无可用题时返回 None。"""
+    d = _kind_dir(unit_number, kind)
+    with _lock:
+        for exam_id in _unseen(unit_number, kind, user_id):
+            try:
+                data = json.loads((d / f"{exam_id}.json").read_text(encoding="utf-8"))
+            except (OSError, json.JSONDecodeError):
+                continue
+            audio_path = d / f"{exam_id}.mp3"
+            audio = audio_path.read_bytes() if audio_path.exists() else None
+            served = _load_served(user_id)
+            served.add(f"{unit_number}/{kind}/{exam_id}")
+            _save_served(user_id, served)
+            _stats["served"] += 1
+            return data, audio
+        _stats["misses"] += 1
+        return None
+
+
+def available(unit_number: int, kind: str, user_id: str) -> int:
+    """该学习者在此单元 / 类型还能直接拿到的题数。"""
+    with _lock:
+        return len(_unseen(unit_number, kind, user_id))
+
+
+def bank_stats() -> dict:
+    with _lock:
+        return {**_stats, "queued": len(_pending)}
+
+
+# ---------------------------------------------------------------------------
+# 后台补货
+# ---------------------------------------------------------------------------
+def request_refill(unit: dict, kind: str, user_id: str) -> None:
+    """
+    题库对该学习者不足 TARGET_DEPTH 份时，排队后台生成（重复请求合并，队列满时忽略）。
+
+    在学习者取走一份题之后调用；未配置 EXAM_BANK_API_KEY 时什么也不做。
+    """
+    global _worker
+    if not bank_api_key():
+        return
+    key = (unit["unit_number"], kind, user_id)
+    with _lock:
+        if key in _pending:
+            return
+        if len(_unseen(unit["unit_number"], kind, user_id)) >= TARGET_DEPTH:
+            return
+        try:
+            _requests.put_nowait((unit, kind, user_id))
+        except queue.Full:
+            return
+        _pending.add(key)
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name="exam-bank", daemon=True)
+            _worker.start()
+
+
+def _refill(unit: dict, kind: str, user_id: str) -> None:
+    n = unit["unit_number"]
+    api_key = bank_api_key()        # 用时再读，Key 不进队列
+    failures = 0
+    while api_key and available(n, kind, user_id) < TARGET_DEPTH and failures < MAX_FAILURES:
+        try:
+            data = build_exam(kind, unit, api_key)
+        except Exception:
+            data = None
+        if data is None:
+            failures += 1
+            with _lock:
+                _stats["failures"] += 1
+            continue
+        audio = None
+        if kind == "co":
+            try:
+                audio = synthesize_french(data["transcript"])
+            except Exception:
+                audio = None        # 出题时页面仍可点「Générer l'audio」补合成
+        add(n, kind, data, audio)
+        with _lock:
+            _stats["generated"] += 1
+
+
+def _run() -> None:
+    while True:
+        unit, kind, user_id = _requests.get()
+        try:
+            _refill(unit, kind, user_id)
+        finally:
+            with _lock:
+                _pending.discard((unit["unit_number"], kind, user_id))
+
+
+# ---------------------------------------------------------------------------
+# 整套准备（并发）
+# ---------------------------------------------------------------------------
+async def _prepare_one(unit: dict, kind: str, user_id: str, api_key: str, out: dict) -> None:
+    """准备一份 CO / CE：题库优先，否则现场生成；CO 拿到 transcript 立即开始合成音频。"""
+    n = unit["unit_number"]
+    banked = take(n, kind, user_id)
+    if banked:
+        data, audio = banked
+    else:
+        try:
+            data = await build_exam_async(kind, unit, api_key)
+        except Exception as e:
+            out["errors"].append(f"{kind.upper()} : {e}")
+            return
+        if data is None:
+            out["errors"].append(f"{kind.upper()} : réponse invalide, réessayez.")
+            return
+        audio = None
+    if kind == "co" and audio is None:
+        try:
+            audio = await synthesize_french_async(data["transcript"])
+        except Exception as e:
+            out["errors"].append(f"Audio : {e}")     # 题目照常发放，页面可再点「Générer l'audio」
+    if not banked:
+        add(n, kind, data, audio, served_to=user_id)
+    out[kind] = data
+    if kind == "co":
+        out["audio"] = audio
+
+
+async def prepare_exam_async(
+    unit: dict, user_id: str, api_key: str, kinds: tuple[str, ...] = KINDS,
+) -> dict:
+    """并发准备 kinds 中的各部分，返回 {"co", "ce", "audio", "errors"}（失败的部分为 None）。"""
+    out: dict = {"co": None, "ce": None, "audio": None, "errors": []}
+    await asyncio.gather(*(_prepare_one(unit, k, user_id, api_key, out) for k in kinds))
+    return out
+
+
+def prepare_exam(
+    unit: dict, user_id: str, api_key: str, kinds: tuple[str, ...] = KINDS,
+) -> dict:
+    """prepare_exam_async 的同步入口，供 Streamlit 脚本线程调用。"""
+    return asyncio.run(prepare_exam_async(unit, user_id, api_key, kinds))
@@ -5,10 +5,24 @@ AI 评分与生成函数 — 口语/写作评分、模考题目生成。
 
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import json
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from collections.abc import Generator, Iterator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
 
+import httpx
 import streamlit as st
-from openai import OpenAI
+from openai import APIConnectionError, APIStatusError, APITimeoutError, OpenAI
+
+from lib.storage import atomic_write_text
 
 # ---------------------------------------------------------------------------
 # API 配置
@@ -16,21 +30,61 @@ from openai import OpenAI
 OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 DEFAULT_MODEL = "google/gemini-2.0-flash-001"
 
+# 连接池：进程内所有会话共享，保持长连接免去每次调用的 TCP + TLS 握手
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "32"))
+LLM_KEEPALIVE_SECONDS = 120
+LLM_CONNECT_TIMEOUT = 5.0
+LLM_READ_TIMEOUT = 120.0       # 长篇评语生成较慢
+
+# 容错：每次调用的总时限（含重试），429 / 5xx / 连接错误按指数退避 + 抖动重试
+LLM_DEADLINE = float(os.environ.get("LLM_DEADLINE_SECONDS", "90"))
+LLM_MAX_ATTEMPTS = int(os.environ.get("LLM_MAX_ATTEMPTS", "4"))
+LLM_BACKOFF_BASE = 0.5
+LLM_BACKOFF_MAX = 8.0
+
+# 对冲请求：主请求超过 p95 延迟仍未返回时，向备用模型并发发出第二个请求，先完成者胜出
+# 未设置 LLM_FALLBACK_MODEL 时关闭；LLM_HEDGE_AFTER_SECONDS 可固定触发延迟
+LLM_FALLBACK_MODEL = os.environ.get("LLM_FALLBACK_MODEL", "")
+LLM_HEDGE_AFTER = float(os.environ.get("LLM_HEDGE_AFTER_SECONDS", "0"))
+LLM_HEDGE_DEFAULT = 15.0       # 延迟样本不足时的触发延迟
+LLM_HEDGE_MIN = 2.0
+LLM_LATENCY_SAMPLES = 200
+
+# 调用遥测：按调用点聚合在内存（llm_metrics），设置 LLM_TELEMETRY_LOG 时另追加 JSONL 明细
+LLM_TELEMETRY_LOG = os.environ.get("LLM_TELEMETRY_LOG", "")
+LLM_LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2000, 4000, 8000, 15000, 30000, 60000, 120000)
+
+# 响应缓存：评分默认缓存，题目生成需 LLM_CACHE_GENERATION=1 显式开启
+# 修改任何 prompt 模板时递增 PROMPT_VERSION，旧缓存随之失效
+PROMPT_VERSION = 3
+LLM_CACHE_DIR = Path(os.environ.get(
+    "LLM_CACHE_DIR", Path(__file__).resolve().parent.parent / "data" / "llm_cache",
+))
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_MB", "64")) * 1024 * 1024
+LLM_CACHE_GENERATION = os.environ.get("LLM_CACHE_GENERATION", "") == "1"
+
 
 # ---------------------------------------------------------------------------
 # API 基础设施
 # ---------------------------------------------------------------------------
-def get_client() -> OpenAI | None:
-    """获取 OpenRouter 客户端，未配置 API Key 时返回 None。"""
-    api_key = (
-        st.session_state.get("openrouter_api_key", "")
-        or st.secrets.get("OPENROUTER_API_KEY", "")
+@st.cache_resource(max_entries=32, show_spinner=False)
+def _shared_client(api_key: str) -> OpenAI:
+    """按 API Key 缓存的进程级客户端（共享 httpx 连接池）。"""
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_SECONDS,
+        ),
+        timeout=httpx.Timeout(
+            LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT, pool=LLM_CONNECT_TIMEOUT,
+        ),
     )
-    if not api_key:
-        return None
     return OpenAI(
         api_key=api_key,
         base_url=OPENROUTER_BASE_URL,
+        http_client=http_client,
+        max_retries=0,             # 重试由 complete_resilient 统一控制
         default_headers={
             "HTTP-Referer": "http://localhost:8501",
             "X-Title": "Francais-B2",
@@ -38,54 +92,725 @@ def get_client() -> OpenAI | None:
     )
 
 
+def get_api_key() -> str:
+    """当前会话可用的 API Key（侧边栏输入优先，其次 secrets）；未配置时为空串。"""
+    return (
+        st.session_state.get("openrouter_api_key", "")
+        or st.secrets.get("OPENROUTER_API_KEY", "")
+    )
+
+
+def bank_api_key() -> str:
+    """题库后台补货专用的服务端 API Key（环境变量或 secrets 中的 EXAM_BANK_API_KEY）；未配置时为空串，不补货。"""
+    return os.environ.get("EXAM_BANK_API_KEY", "") or st.secrets.get("EXAM_BANK_API_KEY", "")
+
+
+def get_client() -> OpenAI | None:
+    """获取 OpenRouter 客户端，未配置 API Key 时返回 None。"""
+    api_key = get_api_key()
+    if not api_key:
+        return None
+    return _shared_client(api_key)
+
+
+def complete(
+    client: OpenAI,
+    system: str,
+    user: str,
+    model: str = DEFAULT_MODEL,
+    temperature: float = 0.7,
+    timeout: float | None = None,
+    response_format: dict | None = None,
+    usage: _Usage | None = None,
+) -> str:
+    """
+    单次补全，失败直接抛异常；不触碰 st.*，可在后台线程调用。
+
+    response_format 为 OpenAI 格式的结构化输出约束（如 json_schema）。
+    usage 非空时累计本次请求的 token 用量（见 _Usage）。
+    """
+    if timeout is not None:
+        client = client.with_options(timeout=timeout)
+    extra = {"response_format": response_format} if response_format else {}
+    if usage is not None:
+        usage.requests += 1
+    resp = client.chat.completions.create(
+        model=model,
+        temperature=temperature,
+        messages=[
+            {"role": "system", "content": system},
+            {"role": "user", "content": user},
+        ],
+        extra_body={"usage": {"include": True}},     # OpenRouter：usage 中附带费用
+        **extra,
+    )
+    if usage is not None:
+        usage.add(resp.usage, resp.model)
+    return resp.choices[0].message.content
+
+
+# ---------------------------------------------------------------------------
+# 容错调用 — 时限 / 退避重试 / 对冲
+# ---------------------------------------------------------------------------
+_latencies: deque[float] = deque(maxlen=LLM_LATENCY_SAMPLES)    # 成功调用的耗时（秒）
+_latency_lock = threading.Lock()
+_hedge_pool = ThreadPoolExecutor(max_workers=LLM_MAX_CONNECTIONS, thread_name_prefix="llm-hedge")
+
+
+def is_retryable(error: Exception) -> bool:
+    """429 / 408 / 5xx 与连接错误（含超时）可重试，其余（如 400、401）直接失败。"""
+    if isinstance(error, APIConnectionError):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in (408, 429) or error.status_code >= 500
+    return False
+
+
+def backoff_delay(error: Exception, attempt: int) -> float:
+    """第 attempt 次失败后的等待秒数：优先服从 Retry-After，否则指数退避 + 全抖动。"""
+    if isinstance(error, APIStatusError):
+        try:
+            return min(LLM_BACKOFF_MAX, float(error.response.headers.get("retry-after", "")))
+        except ValueError:
+            pass
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+def _hedge_delay() -> float:
+    """对冲触发延迟：固定值，或近期成功调用耗时的 p95。"""
+    if LLM_HEDGE_AFTER > 0:
+        return LLM_HEDGE_AFTER
+    with _latency_lock:
+        samples = sorted(_latencies)
+    if len(samples) < 20:
+        return LLM_HEDGE_DEFAULT
+    return max(LLM_HEDGE_MIN, samples[int(len(samples) * 0.95) - 1])
+
+
+def _complete_with_retry(
+    client: OpenAI,
+    system: str,
+    user: str,
+    model: str,
+    temperature: float,
+    deadline_at: float,
+    response_format: dict | None = None,
+    usage: _Usage | None = None,
+) -> str:
+    attempt = 0
+    while True:
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"LLM 请求超过 {LLM_DEADLINE:.0f} 秒未完成")
+        attempt += 1
+        started = time.monotonic()
+        try:
+            text = complete(
+                client, system, user, model, temperature,
+                timeout=remaining, response_format=response_format, usage=usage,
+            )
+        except Exception as e:
+            if attempt >= LLM_MAX_ATTEMPTS or not is_retryable(e):
+                raise
+            delay = backoff_delay(e, attempt)
+            if time.monotonic() + delay >= deadline_at:
+                raise
+            time.sleep(delay)
+            continue
+        with _latency_lock:
+            _latencies.append(time.monotonic() - started)
+        return text
+
+
+def complete_resilient(
+    client: OpenAI,
+    system: str,
+    user: str,
+    model: str = DEFAULT_MODEL,
+    temperature: float = 0.7,
+    deadline: float = LLM_DEADLINE,
+    fallback_model: str = LLM_FALLBACK_MODEL,
+    response_format: dict | None = None,
+    usage: _Usage | None = None,
+) -> str:
+    """
+    带总时限、退避重试与对冲的补全；失败抛异常（超时为 TimeoutError）。
+
+    fallback_model 非空时，主请求超过 p95 延迟仍未返回则向它并发发出第二个请求，
+    取先成功者；落败的请求在后台自然结束（受同一时限约束）。
+    """
+    deadline_at = time.monotonic() + deadline
+    if not fallback_model or fallback_model == model:
+        return _complete_with_retry(
+            client, system, user, model, temperature, deadline_at, response_format, usage,
+        )
+
+    primary = _hedge_pool.submit(
+        _complete_with_retry, client, system, user, model, temperature, deadline_at,
+        response_format, usage,
+    )
+    done, _ = wait([primary], timeout=min(_hedge_delay(), deadline))
+    if done:
+        return primary.result()
+    hedge = _hedge_pool.submit(
+        _complete_with_retry, client, system, user, fallback_model, temperature, deadline_at,
+        response_format, usage,
+    )
+    pending = {primary, hedge}
+    error: Exception | None = None
+    while pending:
+        done, pending = wait(pending, timeout=max(0.0, deadline_at - time.monotonic()),
+                             return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = error or future.exception()
+    raise error or TimeoutError(f"LLM 请求超过 {LLM_DEADLINE:.0f} 秒未完成")
+
+
+# ---------------------------------------------------------------------------
+# 调用遥测 — 每个调用点的延迟 / token / 费用 / 结果
+# ---------------------------------------------------------------------------
+class _Usage:
+    """一次逻辑调用（含重试与对冲）累计的请求数、token、费用与实际应答的模型。"""
+
+    __slots__ = ("requests", "prompt_tokens", "completion_tokens", "cost", "model", "_lock")
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.model = ""
+        self._lock = threading.Lock()      # 对冲时两个线程同时写入
+
+    def add(self, usage, model: str | None) -> None:
+        with self._lock:
+            if usage is not None:
+                self.prompt_tokens += usage.prompt_tokens or 0
+                self.completion_tokens += usage.completion_tokens or 0
+                self.cost += getattr(usage, "cost", None) or 0.0
+            self.model = model or self.model
+
+
+class _SiteStats:
+    """单个调用点的聚合计数。"""
+
+    __slots__ = ("buckets", "count", "total_ms", "max_ms", "outcomes", "models",
+                 "requests", "prompt_tokens", "completion_tokens", "cost")
+
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(LLM_LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.outcomes: dict[str, int] = {}
+        self.models: dict[str, int] = {}
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+
+    def percentile(self, q: float) -> float:
+        """按桶估算分位数（取所在桶上界，不超过实测最大值）。"""
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                bound = LLM_LATENCY_BUCKETS_MS[i] if i < len(LLM_LATENCY_BUCKETS_MS) else self.max_ms
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "outcomes": dict(self.outcomes),
+            "models": dict(self.models),
+            "mean_ms": round(self.total_ms / self.count, 1) if self.count else 0.0,
+            "p50_ms": round(self.percentile(0.50), 1),
+            "p95_ms": round(self.percentile(0.95), 1),
+            "max_ms": round(self.max_ms, 1),
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost": round(self.cost, 6),
+        }
+
+
+_site_stats: dict[str, _SiteStats] = {}
+_site_stats_lock = threading.Lock()
+_telemetry_log_lock = threading.Lock()
+
+
+def _outcome(error: Exception) -> str:
+    if isinstance(error, (TimeoutError, APITimeoutError)):
+        return "timeout"
+    if isinstance(error, APIStatusError) and error.status_code == 429:
+        return "rate_limited"
+    return "error"
+
+
+def _record_call(
+    site: str,
+    model: str,
+    started: float,
+    outcome: str,
+    usage: _Usage | None = None,
+    stream: bool = False,
+) -> None:
+    """记录一次逻辑调用；outcome 取 ok / cache_hit / no_key / partial / timeout / rate_limited / error。"""
+    ms = (time.monotonic() - started) * 1000
+    usage = usage or _Usage()
+    model = usage.model or model
+    with _site_stats_lock:
+        stats = _site_stats.get(site)
+        if stats is None:
+            stats = _site_stats[site] = _SiteStats()
+        stats.buckets[bisect_left(LLM_LATENCY_BUCKETS_MS, ms)] += 1
+        stats.count += 1
+        stats.total_ms += ms
+        stats.max_ms = max(stats.max_ms, ms)
+        stats.outcomes[outcome] = stats.outcomes.get(outcome, 0) + 1
+        stats.models[model] = stats.models.get(model, 0) + 1
+        stats.requests += usage.requests
+        stats.prompt_tokens += usage.prompt_tokens
+        stats.completion_tokens += usage.completion_tokens
+        stats.cost += usage.cost
+    if not LLM_TELEMETRY_LOG:
+        return
+    line = json.dumps({
+        "ts": round(time.time(), 3), "site": site, "model": model, "outcome": outcome,
+        "stream": stream, "latency_ms": round(ms, 1), "requests": usage.requests,
+        "prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens,
+        "cost": usage.cost, "prompt_version": PROMPT_VERSION,
+    })
+    try:
+        with _telemetry_log_lock, open(LLM_TELEMETRY_LOG, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError:
+        pass        # 遥测不影响评分
+
+
+def complete_recorded(
+    site: str,
+    client: OpenAI,
+    system: str,
+    user: str,
+    model: str = DEFAULT_MODEL,
+    temperature: float = 0.7,
+    **kwargs,
+) -> str:
+    """complete_resilient 并以 site 为调用点记录遥测；失败照常抛异常。"""
+    started = time.monotonic()
+    usage = _Usage()
+    try:
+        text = complete_resilient(client, system, user, model, temperature, usage=usage, **kwargs)
+    except Exception as e:
+        _record_call(site, model, started, _outcome(e), usage)
+        raise
+    _record_call(site, model, started, "ok", usage)
+    return text
+
+
+def llm_metrics() -> dict:
+    """{调用点: 次数 / 结果分布 / 模型分布 / 延迟分位数 / 请求数 / token / 费用}"""
+    with _site_stats_lock:
+        return {site: s.snapshot() for site, s in sorted(_site_stats.items())}
+
+
+def reset_llm_metrics() -> None:
+    with _site_stats_lock:
+        _site_stats.clear()
+
+
+# ---------------------------------------------------------------------------
+# 响应缓存 — 内容寻址，本地磁盘 LRU
+# ---------------------------------------------------------------------------
+class _ResponseCache:
+    """
+    key = sha256(模板版本, 模型, 温度, system, user)，每条响应一个文件。
+
+    命中时更新 mtime；总大小超过上限时按 mtime 从旧到新淘汰。
+    进程内维护 {key: 字节数} 的 LRU 索引，首次使用时从磁盘扫描一次。
+    """
+
+    def __init__(self, root: Path, max_bytes: int) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self._index: OrderedDict[str, int] | None = None
+        self._total = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "bytes_saved": 0, "stores": 0, "evictions": 0}
+
+    @staticmethod
+    def key(model: str, temperature: float, system: str, user: str) -> str:
+        blob = json.dumps(
+            [PROMPT_VERSION, model, temperature, system, user], ensure_ascii=False,
+        )
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.txt"
+
+    def _load_index(self) -> OrderedDict[str, int]:
+        if self._index is None:
+            entries = []
+            for path in self.root.glob("*/*.txt"):
+                try:
+                    info = path.stat()
+                except OSError:
+                    continue
+                entries.append((info.st_mtime, path.stem, info.st_size))
+            entries.sort()
+            self._index = OrderedDict((k, size) for _mtime, k, size in entries)
+            self._total = sum(self._index.values())
+        return self._index
+
+    def get(self, key: str) -> str | None:
+        path = self._path(key)
+        with self._lock:
+            index = self._load_index()
+            try:
+                text = path.read_text(encoding="utf-8")
+            except OSError:
+                self.stats["misses"] += 1
+                return None
+            os.utime(path)
+            index[key] = index.pop(key, len(text.encode("utf-8")))
+            self.stats["hits"] += 1
+            self.stats["bytes_saved"] += index[key]
+            return text
+
+    def put(self, key: str, text: str) -> None:
+        data_len = len(text.encode("utf-8"))
+        with self._lock:
+            index = self._load_index()
+            atomic_write_text(self._path(key), text)
+            self._total += data_len - index.pop(key, 0)
+            index[key] = data_len
+            self.stats["stores"] += 1
+            while self._total > self.max_bytes and len(index) > 1:
+                old, size = index.popitem(last=False)
+                self._path(old).unlink(missing_ok=True)
+                self._total -= size
+                self.stats["evictions"] += 1
+
+    def report(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "entries": len(self._index or ()),
+                "bytes": self._total,
+            }
+
+
+_response_cache = _ResponseCache(LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES)
+
+
+def llm_cache_stats() -> dict:
+    """响应缓存统计：hits / misses / hit_rate / bytes_saved / entries / bytes / evictions。"""
+    return _response_cache.report()
+
+
 def call_gpt(
     system: str,
     user: str,
     model: str = DEFAULT_MODEL,
     temperature: float = 0.7,
+    cache: bool = False,
+    response_format: dict | None = None,
+    site: str = "call_gpt",
 ) -> str | None:
-    """调用 LLM，返回文本响应；失败时返回 None 并显示错误。"""
+    """
+    调用 LLM，返回文本响应；失败时返回 None 并显示错误。
+
+    超时、重试与对冲见 complete_resilient；每次调用以 site 为调用点记录遥测。
+    cache=True 时相同 (模板版本, 模型, 温度, 输入) 直接返回缓存的响应。
+    """
+    started = time.monotonic()
+    cache_key = _response_cache.key(model, temperature, system, user) if cache else None
+    if cache_key is not None:
+        cached = _response_cache.get(cache_key)
+        if cached is not None:
+            _record_call(site, model, started, "cache_hit")
+            return cached
     client = get_client()
     if client is None:
+        _record_call(site, model, started, "no_key")
         st.warning("请先在侧边栏输入 OpenRouter API Key。")
         return None
     try:
-        resp = client.chat.completions.create(
-            model=model,
-            temperature=temperature,
-            messages=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": user},
-            ],
+        text = complete_recorded(
+            site, client, system, user, model, temperature, response_format=response_format,
         )
-        return resp.choices[0].message.content
     except Exception as e:
         st.error(f"API 调用失败: {e}")
         return None
+    if cache_key is not None and text:
+        _response_cache.put(cache_key, text)
+    return text
+
+
+def call_gpt_stream(
+    system: str,
+    user: str,
+    model: str = DEFAULT_MODEL,
+    temperature: float = 0.7,
+    cache: bool = False,
+    site: str = "call_gpt_stream",
+) -> Generator[str, None, bool]:
+    """
+    call_gpt 的流式版本：逐段产出文本，供 st.write_stream 边生成边渲染。
+
+    缓存命中时一次性产出完整文本；流结束后把完整文本写入缓存。
+    首段文本到达前的 429 / 5xx / 连接错误按退避重试，总时限同 call_gpt；不做对冲。
+    失败时显示错误并提前结束（已产出的部分保留）。
+    生成器返回值：完整结束（含缓存命中）为 True，失败 / 未配置 Key 为 False。
+    """
+    started = time.monotonic()
+    cache_key = _response_cache.key(model, temperature, system, user) if cache else None
+    if cache_key is not None:
+        cached = _response_cache.get(cache_key)
+        if cached is not None:
+            _record_call(site, model, started, "cache_hit", stream=True)
+            yield cached
+            return True
+    client = get_client()
+    if client is None:
+        _record_call(site, model, started, "no_key", stream=True)
+        st.warning("请先在侧边栏输入 OpenRouter API Key。")
+        return False
+    usage = _Usage()
+    parts: list[str] = []
+    deadline_at = time.monotonic() + LLM_DEADLINE
+    attempt = 0
+    while True:
+        attempt += 1
+        usage.requests += 1
+        try:
+            stream = client.with_options(
+                timeout=max(0.1, deadline_at - time.monotonic()),
+            ).chat.completions.create(
+                model=model,
+                temperature=temperature,
+                messages=[
+                    {"role": "system", "content": system},
+                    {"role": "user", "content": user},
+                ],
+                stream=True,
+                stream_options={"include_usage": True},      # 最后一段附带 token 用量
+                extra_body={"usage": {"include": True}},
+            )
+            for chunk in stream:
+                if chunk.usage is not None:
+                    usage.add(chunk.usage, chunk.model)
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+                if time.monotonic() > deadline_at:
+                    stream.close()
+                    raise TimeoutError(f"LLM 请求超过 {LLM_DEADLINE:.0f} 秒未完成")
+            break
+        except Exception as e:
+            # 已产出内容后不再重试，避免重复输出
+            delay = backoff_delay(e, attempt)
+            if (parts or attempt >= LLM_MAX_ATTEMPTS or not is_retryable(e)
+                    or time.monotonic() + delay >= deadline_at):
+                _record_call(site, model, started, "partial" if parts else _outcome(e), usage, stream=True)
+                st.error(f"API 调用失败: {e}")
+                return False
+            time.sleep(delay)
+    _record_call(site, model, started, "ok", usage, stream=True)
+    if cache_key is not None and parts:
+        _response_cache.put(cache_key, "".join(parts))
+    return True
 
 
-def parse_json_response(raw: str | None) -> dict | list | None:
-    """从 LLM 响应中提取 JSON，自动去除 markdown 围栏。"""
+def extract_json(raw: str | None) -> dict | list | None:
+    """从 LLM 响应中提取 JSON（去除 markdown 围栏）；解析失败返回 None。"""
     if raw is None:
         return None
     raw = raw.strip()
     if raw.startswith("```"):
-        raw = raw.split("\n", 1)[1]
+        raw = raw.partition("\n")[2]           # 只有围栏没有内容时为空串
     if raw.endswith("```"):
         raw = raw.rsplit("```", 1)[0]
     try:
         return json.loads(raw.strip())
-    except json.JSONDecodeError:
-        st.error("JSON 解析失败，请重试。")
+    except (json.JSONDecodeError, ValueError):
+        return None
+
+
+# ---------------------------------------------------------------------------
+# 结构化评分 — 各评分标准得分 + 总分，与 markdown 评语一并保存
+# ---------------------------------------------------------------------------
+RUBRICS: dict[str, tuple[tuple[str, int], ...]] = {
+    "oral": (
+        ("Fluidité et cohérence", 8),
+        ("Étendue du vocabulaire", 8),
+        ("Correction grammaticale", 9),
+    ),
+    "writing": (
+        ("Respect de la consigne", 5),
+        ("Capacité à argumenter", 5),
+        ("Cohérence et cohésion", 5),
+        ("Compétence lexicale", 5),
+        ("Compétence grammaticale", 5),
+    ),
+    "exam_writing": (
+        ("Respect de la consigne", 10),
+        ("Capacité à argumenter", 10),
+        ("Cohérence et cohésion", 10),
+        ("Compétence lexicale", 10),
+        ("Compétence grammaticale", 10),
+    ),
+}
+SCORES_MARKER = "SCORES_JSON:"
+
+
+def rubric_max(kind: str) -> int:
+    return sum(m for _name, m in RUBRICS[kind])
+
+
+def _scores_line_instruction(kind: str) -> str:
+    """流式评分：评语末尾附一行机器可读的分数（显示时隐藏）。"""
+    n = len(RUBRICS[kind])
+    return f"""
+
+After the feedback, end your response with exactly one final line in this format (no markdown around it):
+{SCORES_MARKER} {{"criteria": [<{n} numbers, one per criterion above, in order>], "total": <number out of {rubric_max(kind)}>}}"""
+
+
+def _rubric_format(kind: str) -> dict:
+    """非流式评分的结构化输出约束。"""
+    n = len(RUBRICS[kind])
+    return _json_schema_format(f"rubric_{kind}", {
+        "type": "object",
+        "properties": {
+            "criteria": {"type": "array", "items": {"type": "number"}, "minItems": n, "maxItems": n},
+            "total": {"type": "number"},
+            "feedback": {"type": "string"},
+        },
+        "required": ["criteria", "total", "feedback"],
+        "additionalProperties": False,
+    })
+
+
+_RECORD_INSTRUCTION = """
+
+Return a JSON object: "criteria" = the score of each criterion above, in order; "total" = the TOTAL score; "feedback" = everything else you were asked to provide, as markdown with clear headers."""
+
+
+def rubric_record(kind: str, data) -> dict | None:
+    """
+    校验模型给出的分数，返回 {"criteria": [分数, ...], "total", "max"}；不合格返回 None。
+
+    总分可低于各项之和（跑题封顶规则），但不得超过满分。
+    """
+    if not isinstance(data, dict):
+        return None
+    criteria = data.get("criteria")
+    rubric = RUBRICS[kind]
+    if not isinstance(criteria, list) or len(criteria) != len(rubric):
+        return None
+    scores = []
+    for value, (_name, top) in zip(criteria, rubric):
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value <= top:
+            return None
+        scores.append(value)
+    total = data.get("total")
+    if isinstance(total, bool) or not isinstance(total, (int, float)):
+        total = sum(scores)
+    if not 0 <= total <= rubric_max(kind):
+        return None
+    return {"criteria": scores, "total": total, "max": rubric_max(kind)}
+
+
+def split_scores(kind: str, text: str) -> tuple[str, dict | None]:
+    """把流式评语拆成（显示用 markdown, 结构化分数）。"""
+    head, sep, tail = text.rpartition(SCORES_MARKER)
+    if not sep:
+        return text.rstrip(), None
+    # 模型可能把分数放进 ```json 围栏、换行后才给出，所以整段尾巴一起解析；不行再退回只看首行
+    data = extract_json(tail)
+    if data is None:
+        data = extract_json(tail.strip().partition("\n")[0])
+    return head.rstrip(), rubric_record(kind, data)
+
+
+class GradeStream:
+    """
+    流式评语：迭代产出可直接显示的 markdown（末尾分数行不显示），供 st.write_stream 使用。
+
+    迭代结束后 .rubric 为结构化分数（模型未给出或不合格时为 None），
+    .complete 表示评语是否完整生成（中途失败时只有前半段，不应当作最终评语保存）。
+    """
+
+    def __init__(self, kind: str, chunks: Iterator[str]) -> None:
+        self.kind = kind
+        self._chunks = chunks
+        self.rubric: dict | None = None
+        self.complete = False
+
+    def __iter__(self) -> Iterator[str]:
+        text = ""
+        shown = 0
+        chunks = iter(self._chunks)
+        while True:
+            try:
+                chunk = next(chunks)
+            except StopIteration as stop:
+                self.complete = stop.value is not False    # call_gpt_stream 的返回值
+                break
+            text += chunk
+            # 分数行之前的内容照常输出；留一个标记长度的尾巴，防止标记被拆在两段之间
+            cut = text.find(SCORES_MARKER)
+            safe = cut if cut >= 0 else len(text) - len(SCORES_MARKER)
+            safe = len(text[:safe].rstrip())        # 末尾空白也留到最后，分数行前不多出空行
+            if safe > shown:
+                yield text[shown:safe]
+                shown = safe
+        display, self.rubric = split_scores(self.kind, text)
+        if len(display) > shown:
+            yield display[shown:]
+
+
+def grading_request(kind: str, text: str, subject: dict | str) -> tuple[str, dict]:
+    """
+    非流式结构化评分的 (system prompt, response_format)，用户消息即 text。
+
+    subject：oral / writing 为单元 dict，exam_writing 为写作题目文本。
+    不触碰 st.*，批量评分等离线调用方可直接使用。
+    """
+    build = {
+        "oral": _oral_system,
+        "writing": _writing_system,
+        "exam_writing": _exam_blanc_writing_system,
+    }[kind]
+    return build(text, subject) + _RECORD_INSTRUCTION, _rubric_format(kind)
+
+
+def parse_grade(kind: str, raw: str | None) -> dict | None:
+    """解析结构化评分响应 → {"criteria", "total", "max", "feedback"}；不合格返回 None。"""
+    data = extract_json(raw)
+    record = rubric_record(kind, data)
+    if record is None:
         return None
+    return {**record, "feedback": str(data.get("feedback", ""))}
 
 
 # ---------------------------------------------------------------------------
 # 口语评分
 # ---------------------------------------------------------------------------
-def grade_oral(text: str, unit: dict) -> str | None:
-    """DELF B2 口语评分（25 分制）。"""
-    system = f"""You are a DELF B2 oral examiner. The student was asked to present an oral argument on the theme: "{unit['theme']}".
+def _oral_system(text: str, unit: dict) -> str:
+    """口语评分的 system prompt。"""
+    return f"""You are a DELF B2 oral examiner. The student was asked to present an oral argument on the theme: "{unit['theme']}".
 
 The following text was transcribed from speech via speech-to-text (STT):
 \"\"\"{text}\"\"\"
@@ -113,15 +838,20 @@ Provide:
 - 2-3 actionable suggestions for improvement
 
 Format your response clearly with headers."""
-    return call_gpt(system, text)
+
+
+def stream_grade_oral(text: str, unit: dict) -> GradeStream:
+    """DELF B2 口语评分（25 分制）：边生成边显示评语，结束后 .rubric 为分数。"""
+    system = _oral_system(text, unit) + _scores_line_instruction("oral")
+    return GradeStream("oral", call_gpt_stream(system, text, cache=True, site="stream_grade_oral"))
 
 
 # ---------------------------------------------------------------------------
 # 写作评分
 # ---------------------------------------------------------------------------
-def grade_writing(text: str, unit: dict) -> str | None:
-    """DELF B2 写作评分（25 分制）。"""
-    system = f"""You are a DELF B2 written production examiner. The writing task theme is: "{unit['theme']}".
+def _writing_system(text: str, unit: dict) -> str:
+    """写作评分的 system prompt。"""
+    return f"""You are a DELF B2 written production examiner. The writing task theme is: "{unit['theme']}".
 
 Here is the student's text:
 \"\"\"{text}\"\"\"
@@ -143,15 +873,199 @@ Provide:
 - 2-3 suggestions for improvement
 
 Format your response clearly with headers."""
-    return call_gpt(system, text)
+
+
+def stream_grade_writing(text: str, unit: dict) -> GradeStream:
+    """DELF B2 写作评分（25 分制）：边生成边显示评语，结束后 .rubric 为分数。"""
+    system = _writing_system(text, unit) + _scores_line_instruction("writing")
+    return GradeStream("writing", call_gpt_stream(system, text, cache=True, site="stream_grade_writing"))
+
+
+# ---------------------------------------------------------------------------
+# 模考题结构 — JSON Schema（结构化输出）/ 本地校验 / 局部修复
+# ---------------------------------------------------------------------------
+EXAM_TEXT_FIELD = {"co": "transcript", "ce": "article"}
+EXAM_QUESTIONS = 6
+OPTION_LETTERS = ("A", "B", "C", "D")
+
+_QUESTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "id": {"type": "integer"},
+        "question": {"type": "string"},
+        "options": {"type": "array", "items": {"type": "string"}, "minItems": 4, "maxItems": 4},
+        "correct": {"type": "string", "enum": list(OPTION_LETTERS)},
+    },
+    "required": ["id", "question", "options", "correct"],
+    "additionalProperties": False,
+}
+
+
+def _json_schema_format(name: str, schema: dict) -> dict:
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+
+
+def _exam_format(kind: str) -> dict:
+    """整份 CO / CE 模考题的结构化输出约束。"""
+    field = EXAM_TEXT_FIELD[kind]
+    return _json_schema_format(f"exam_{kind}", {
+        "type": "object",
+        "properties": {
+            field: {"type": "string"},
+            "source_description": {"type": "string"},
+            "questions": {
+                "type": "array", "items": _QUESTION_SCHEMA,
+                "minItems": EXAM_QUESTIONS, "maxItems": EXAM_QUESTIONS,
+            },
+        },
+        "required": [field, "source_description", "questions"],
+        "additionalProperties": False,
+    })
+
+
+def _questions_format(n: int) -> dict:
+    """只补题时的结构化输出约束：n 道选择题。"""
+    return _json_schema_format("exam_questions", {
+        "type": "object",
+        "properties": {
+            "questions": {"type": "array", "items": _QUESTION_SCHEMA, "minItems": n, "maxItems": n},
+        },
+        "required": ["questions"],
+        "additionalProperties": False,
+    })
+
+
+def _has_prefix(option: str, letter: str) -> bool:
+    """选项以「A.」或「A)」这样的字母前缀开头（只看首字母会把 "Avec…" 误当作 A）。"""
+    return option[:2] in (f"{letter}.", f"{letter})")
+
+
+def _strip_prefix(option: str) -> str:
+    """去掉选项开头的全部字母前缀（含误加的 "B. A. …"），只留选项内容。"""
+    option = option.strip()
+    while len(option) >= 2 and option[0] in OPTION_LETTERS and option[1] in ".)":
+        option = option[2:].lstrip()
+    return option
+
+
+def _question_errors(q) -> list[str]:
+    if not isinstance(q, dict) or not isinstance(q.get("question"), str) or not q["question"].strip():
+        return ["missing question"]
+    options = q.get("options")
+    if (not isinstance(options, list) or len(options) != 4
+            or not all(isinstance(o, str) and o.strip() for o in options)):
+        return ["expected 4 options"]
+    # 判分按选项前缀字母匹配（ans.startswith(correct)），选项需依次以 A-D 开头且互不相同
+    if any(not _has_prefix(o, letter) for o, letter in zip(options, OPTION_LETTERS)):
+        return ["options must start with A-D"]
+    if len({_strip_prefix(o).casefold() for o in options}) != 4:
+        return ["duplicate options"]
+    if q.get("correct") not in OPTION_LETTERS:
+        return ["invalid correct letter"]
+    return []
+
+
+def validate_exam(kind: str, data) -> list[str]:
+    """检查生成的 CO / CE 模考题结构，返回问题列表（空列表 = 合格）。"""
+    if not isinstance(data, dict):
+        return ["not a JSON object"]
+    errors = []
+    text = data.get(EXAM_TEXT_FIELD[kind])
+    if not isinstance(text, str) or not text.strip():
+        errors.append(f"missing {EXAM_TEXT_FIELD[kind]}")
+    questions = data.get("questions")
+    if not isinstance(questions, list) or len(questions) != EXAM_QUESTIONS:
+        return errors + [f"expected {EXAM_QUESTIONS} questions"]
+    for i, q in enumerate(questions, 1):
+        errors.extend(f"Q{i}: {e}" for e in _question_errors(q))
+    return errors
+
+
+def _repair_question(q):
+    """本地修复常见小问题：选项缺字母前缀、correct 写成 "b" / "B." / "B. 原文"。"""
+    if not isinstance(q, dict):
+        return q
+    q = dict(q)
+    options = q.get("options")
+    if isinstance(options, list) and len(options) == 4 and all(isinstance(o, str) for o in options):
+        # 只补缺失的前缀；字母错位（如 B 位上的 "A. x"）说明选项重复或错序，改字母会改变答案，留给模型重出
+        q["options"] = [
+            o if _strip_prefix(o) != o.strip() else f"{letter}. {o.strip()}"
+            for o, letter in zip(options, OPTION_LETTERS)
+        ]
+    correct = q.get("correct")
+    if isinstance(correct, str) and correct.strip()[:1].upper() in OPTION_LETTERS:
+        q["correct"] = correct.strip()[0].upper()
+    return q
+
+
+def _broken_questions(data: dict) -> list[int]:
+    """需要重新出的题目下标（含缺失的题位），已去掉多余的题。"""
+    questions = data["questions"]
+    broken = [i for i, q in enumerate(questions) if _question_errors(q)]
+    return broken + list(range(len(questions), EXAM_QUESTIONS))
+
+
+def _questions_system(kind: str, n: int) -> str:
+    """只为已有文本补出 n 道选择题的 system prompt。"""
+    doc = "transcript of a French radio broadcast" if kind == "co" else "French article"
+    return f"""You are a DELF B2 exam creator. The user message is the {doc} of a comprehension exam.
+
+Write exactly {n} new multiple-choice comprehension questions about it, in this JSON format:
+{{
+  "questions": [
+    {{
+      "id": 1,
+      "question": "<question in French>",
+      "options": ["A. <answer>", "B. <answer>", "C. <answer>", "D. <answer>"],
+      "correct": "A"
+    }}
+  ]
+}}
+
+All in French. Difficulty: DELF B2. Return ONLY valid JSON, no markdown fences."""
+
+
+def repair_exam(kind: str, data, ask_questions) -> dict | None:
+    """
+    校验并尽量修复一份 CO / CE 模考题，返回合格的题目；无法修复时返回 None。
+
+    先做本地修复；文本完好而个别题目损坏 / 缺失时，只调用 ask_questions(system, text, n)
+    重新出这 n 道题（返回原始响应文本），不重新生成整份。
+    """
+    if not isinstance(data, dict):
+        return None
+    field = EXAM_TEXT_FIELD[kind]
+    text = data.get(field)
+    if not isinstance(text, str) or not text.strip():
+        return None          # 文本本身缺失，只能整份重来
+    questions = data.get("questions")
+    if not isinstance(questions, list):
+        questions = []
+    data = {**data, "questions": [_repair_question(q) for q in questions[:EXAM_QUESTIONS]]}
+    broken = _broken_questions(data)
+    if broken:
+        raw = ask_questions(_questions_system(kind, len(broken)), text, len(broken))
+        extra = extract_json(raw)
+        extra = extra.get("questions") if isinstance(extra, dict) else None
+        if not isinstance(extra, list) or len(extra) < len(broken):
+            return None
+        questions = data["questions"] + [None] * (EXAM_QUESTIONS - len(data["questions"]))
+        for i, q in zip(broken, extra):
+            questions[i] = _repair_question(q)
+        data["questions"] = questions
+    for i, q in enumerate(data["questions"], 1):
+        if isinstance(q, dict):
+            q["id"] = i
+    return data if not validate_exam(kind, data) else None
 
 
 # ---------------------------------------------------------------------------
 # 模考听力题生成
 # ---------------------------------------------------------------------------
-def generate_exam_co(unit: dict) -> dict | None:
-    """生成 DELF B2 听力理解模考题（含文本 transcript + 6 道选择题）。"""
-    system = f"""You are a DELF B2 exam creator. Generate a "Compréhension de l'oral" section for the theme: "{unit['theme']}".
+def _exam_co_system(unit: dict) -> str:
+    """听力模考题生成的 system prompt。"""
+    return f"""You are a DELF B2 exam creator. Generate a "Compréhension de l'oral" section for the theme: "{unit['theme']}".
 
 Since this is a digital app without audio, simulate the listening by providing a WRITTEN TRANSCRIPT of a realistic French radio interview or debate (~200 words) related to the theme.
 
@@ -174,16 +1088,19 @@ Requirements:
 - Questions should test: general understanding (2), detailed comprehension (2), implicit meaning/opinion (2)
 - All in French. Difficulty: DELF B2
 - Return ONLY valid JSON, no markdown fences."""
-    raw = call_gpt(system, f"Theme: {unit['theme']}", temperature=0.8)
-    return parse_json_response(raw)
+
+
+def generate_exam_co(unit: dict) -> dict | None:
+    """生成 DELF B2 听力理解模考题（含文本 transcript + 6 道选择题）。"""
+    return _generate_exam("co", unit)
 
 
 # ---------------------------------------------------------------------------
 # 模考阅读题生成
 # ---------------------------------------------------------------------------
-def generate_exam_ce(unit: dict) -> dict | None:
-    """生成 DELF B2 阅读理解模考题（含文章 + 6 道选择题）。"""
-    system = f"""You are a DELF B2 exam creator. Generate a "Compréhension des écrits" section for the theme: "{unit['theme']}".
+def _exam_ce_system(unit: dict) -> str:
+    """阅读模考题生成的 system prompt。"""
+    return f"""You are a DELF B2 exam creator. Generate a "Compréhension des écrits" section for the theme: "{unit['theme']}".
 
 Create a realistic French article or opinion piece (~300 words) related to the theme, then generate 6 comprehension questions.
 
@@ -206,16 +1123,73 @@ Requirements:
 - Questions should test: main idea (1), detail retrieval (2), vocabulary in context (1), author's opinion/tone (1), inference (1)
 - All in French. Difficulty: DELF B2
 - Return ONLY valid JSON, no markdown fences."""
-    raw = call_gpt(system, f"Theme: {unit['theme']}", temperature=0.8)
-    return parse_json_response(raw)
+
+
+def generate_exam_ce(unit: dict) -> dict | None:
+    """生成 DELF B2 阅读理解模考题（含文章 + 6 道选择题）。"""
+    return _generate_exam("ce", unit)
+
+
+def _exam_system(kind: str, unit: dict) -> str:
+    return _exam_co_system(unit) if kind == "co" else _exam_ce_system(unit)
+
+
+def _generate_exam(kind: str, unit: dict) -> dict | None:
+    """结构化输出生成 + 本地校验 / 局部修复；仍不合格时提示重试。"""
+    raw = call_gpt(
+        _exam_system(kind, unit), f"Theme: {unit['theme']}",
+        temperature=0.8, cache=LLM_CACHE_GENERATION, response_format=_exam_format(kind),
+        site=f"generate_exam_{kind}",
+    )
+    if raw is None:
+        return None
+
+    def ask_questions(system: str, text: str, n: int) -> str | None:
+        return call_gpt(
+            system, text, temperature=0.8, response_format=_questions_format(n),
+            site=f"repair_exam_{kind}",
+        )
+
+    data = repair_exam(kind, extract_json(raw), ask_questions)
+    if data is None:
+        st.error("题目结构不完整，请重试。")
+    return data
+
+
+# ---------------------------------------------------------------------------
+# 后台生成
+# ---------------------------------------------------------------------------
+def build_exam(kind: str, unit: dict, api_key: str) -> dict | None:
+    """
+    用指定 API Key 生成一份 CO / CE 模考题（不走缓存、不触碰 st.*，供后台线程调用）。
+
+    API 失败时抛异常；修复后仍不合格时返回 None。
+    """
+    client = _shared_client(api_key)
+    raw = complete_recorded(
+        f"build_exam_{kind}", client, _exam_system(kind, unit), f"Theme: {unit['theme']}",
+        temperature=0.8, response_format=_exam_format(kind),
+    )
+    return repair_exam(
+        kind, extract_json(raw),
+        lambda system, text, n: complete_recorded(
+            f"repair_exam_{kind}", client, system, text,
+            temperature=0.8, response_format=_questions_format(n),
+        ),
+    )
+
+
+async def build_exam_async(kind: str, unit: dict, api_key: str) -> dict | None:
+    """build_exam 的协程版本：阻塞调用放进线程池，与其他生成 / 合成步骤并发。"""
+    return await asyncio.to_thread(build_exam, kind, unit, api_key)
 
 
 # ---------------------------------------------------------------------------
 # 模考写作评分（50 分制）
 # ---------------------------------------------------------------------------
-def grade_exam_blanc_writing(text: str, prompt: str) -> str | None:
-    """DELF B2 模考写作评分（50 分制，标准分翻倍）。"""
-    system = f"""You are a DELF B2 written production examiner. Grade this exam essay.
+def _exam_blanc_writing_system(text: str, prompt: str) -> str:
+    """模考写作评分的 system prompt。"""
+    return f"""You are a DELF B2 written production examiner. Grade this exam essay.
 
 **Sujet :** {prompt}
 
@@ -238,7 +1212,12 @@ Provide:
 - Corrected sentences where errors are found
 - 3 concrete suggestions for improvement
 
-Format with clear headers. Be rigorous — this simulates a real DELF B2 exam.
-End your response with exactly this line:
-SCORE_TOTAL: [number]/50"""
-    return call_gpt(system, text)
+Format with clear headers. Be rigorous — this simulates a real DELF B2 exam."""
+
+
+def stream_grade_exam_blanc_writing(text: str, prompt: str) -> GradeStream:
+    """DELF B2 模考写作评分（50 分制，标准分翻倍）：边生成边显示评语，结束后 .rubric 为分数。"""
+    system = _exam_blanc_writing_system(text, prompt) + _scores_line_instruction("exam_writing")
+    return GradeStream("exam_writing", call_gpt_stream(
+        system, text, cache=True, site="stream_grade_exam_blanc_writing",
+    ))
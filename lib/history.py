@@ -0,0 +1,198 @@
+"""
+分数历史 — 定长环形缓冲（最近作答明细）+ 日 / 周汇总（更早的数据）。
+
+全部用 array 列存储，持久化体积和每次保存的成本都有上限：
+- 环形缓冲保留最近 RING_SIZE 次作答 (时间戳, 单元, 分数)
+- 被挤出的作答折叠进按天汇总 (count, sum, best)
+- 超过 DAILY_DAYS 天的日汇总再折叠进按周汇总
+只依赖标准库。
+"""
+
+from __future__ import annotations
+
+import time
+from array import array
+
+DAY = 86400
+
+RING_SIZE = 200
+DAILY_DAYS = 90
+WEEKLY_WEEKS = 520
+
+
+def _day_of(ts: float) -> int:
+    """UTC 日序号（自 1970-01-01 起）。"""
+    return int(ts // DAY)
+
+
+def _week_of(day: int) -> int:
+    """周序号，周一为一周开始（1970-01-01 是周四）。"""
+    return (day + 3) // 7
+
+
+# ---------------------------------------------------------------------------
+# 汇总桶 — 列存储 (key, count, sum, best)
+# ---------------------------------------------------------------------------
+class _Rollup:
+    """按 key（日或周序号）升序排列的汇总桶。"""
+
+    def __init__(self) -> None:
+        self.key = array("l")
+        self.count = array("l")
+        self.sum = array("l")
+        self.best = array("h")
+
+    def __len__(self) -> int:
+        return len(self.key)
+
+    def add(self, key: int, count: int, total: int, best: int) -> None:
+        """并入一个桶；时间单调递增，只需检查最后一个桶。"""
+        if self.key and self.key[-1] == key:
+            self.count[-1] += count
+            self.sum[-1] += total
+            self.best[-1] = max(self.best[-1], best)
+            return
+        self.key.append(key)
+        self.count.append(count)
+        self.sum.append(total)
+        self.best.append(best)
+
+    def pop_oldest(self) -> tuple[int, int, int, int]:
+        row = (self.key[0], self.count[0], self.sum[0], self.best[0])
+        for col in (self.key, self.count, self.sum, self.best):
+            del col[0]
+        return row
+
+    def rows(self):
+        return zip(self.key, self.count, self.sum, self.best)
+
+    def to_dict(self) -> dict:
+        return {
+            "key": self.key.tolist(),
+            "count": self.count.tolist(),
+            "sum": self.sum.tolist(),
+            "best": self.best.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> _Rollup:
+        r = cls()
+        r.key.extend(data.get("key", []))
+        r.count.extend(data.get("count", []))
+        r.sum.extend(data.get("sum", []))
+        r.best.extend(data.get("best", []))
+        return r
+
+
+# ---------------------------------------------------------------------------
+# 分数历史
+# ---------------------------------------------------------------------------
+class ScoreHistory:
+    """有界分数历史：环形缓冲 + 日汇总 + 周汇总。"""
+
+    def __init__(self, ring_size: int = RING_SIZE) -> None:
+        self.ring_size = ring_size
+        self._ts = array("d", [0.0]) * ring_size
+        self._unit = array("b", [0]) * ring_size
+        self._pct = array("h", [0]) * ring_size
+        self._head = 0          # 下一个写入位置
+        self._size = 0
+        self.daily = _Rollup()
+        self.weekly = _Rollup()
+
+    # -- 写入 --
+    def record(self, unit: int, pct: int, ts: float | None = None) -> None:
+        """追加一次作答；缓冲已满时最旧的一条折叠进日汇总。"""
+        if ts is None:
+            ts = time.time()
+        if self._size == self.ring_size:
+            old = self._head
+            self._roll_up(self._ts[old], self._pct[old])
+        else:
+            self._size += 1
+        self._ts[self._head] = ts
+        self._unit[self._head] = unit
+        self._pct[self._head] = pct
+        self._head = (self._head + 1) % self.ring_size
+
+    def _roll_up(self, ts: float, pct: int) -> None:
+        self.add_rollup(_day_of(ts), 1, pct, pct)
+
+    def add_rollup(self, day: int, count: int, total: int, best: int) -> None:
+        """直接并入一天的汇总（按日序号升序调用）；过旧的日汇总再折叠为周汇总。"""
+        self.daily.add(day, count, total, best)
+        while len(self.daily) > DAILY_DAYS:
+            day, count, total, best = self.daily.pop_oldest()
+            self.weekly.add(_week_of(day), count, total, best)
+        while len(self.weekly) > WEEKLY_WEEKS:
+            self.weekly.pop_oldest()
+
+    # -- 查询 --
+    def recent(self):
+        """按时间顺序遍历缓冲中的 (ts, unit, pct)。"""
+        start = (self._head - self._size) % self.ring_size
+        for i in range(self._size):
+            j = (start + i) % self.ring_size
+            yield self._ts[j], self._unit[j], self._pct[j]
+
+    @property
+    def count(self) -> int:
+        """历史总作答次数（含已汇总部分）。"""
+        return self._size + sum(self.daily.count) + sum(self.weekly.count)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def trend(self) -> list[tuple[int, int, int, int]]:
+        """
+        长期趋势：[(起始日序号, count, mean, best), ...]，按时间升序。
+
+        周汇总按周给点，日汇总和缓冲明细按天给点。
+        """
+        points: list[tuple[int, int, int, int]] = []
+        for week, count, total, best in self.weekly.rows():
+            points.append((week * 7 - 3, count, round(total / count), best))
+        days = _Rollup()
+        for row in self.daily.rows():
+            days.add(*row)
+        for ts, _unit, pct in self.recent():
+            days.add(_day_of(ts), 1, pct, pct)
+        for day, count, total, best in days.rows():
+            points.append((day, count, round(total / count), best))
+        return points
+
+    # -- 序列化 --
+    def to_dict(self) -> dict:
+        ts, units, pcts = [], [], []
+        for t, u, p in self.recent():
+            ts.append(int(t))
+            units.append(u)
+            pcts.append(p)
+        return {
+            "v": 1,
+            "ring_size": self.ring_size,
+            "ring": {"ts": ts, "unit": units, "pct": pcts},
+            "daily": self.daily.to_dict(),
+            "weekly": self.weekly.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> ScoreHistory:
+        h = cls(data.get("ring_size", RING_SIZE))
+        h.daily = _Rollup.from_dict(data.get("daily", {}))
+        h.weekly = _Rollup.from_dict(data.get("weekly", {}))
+        ring = data.get("ring", {})
+        for t, u, p in zip(ring.get("ts", []), ring.get("unit", []), ring.get("pct", [])):
+            h.record(u, p, t)
+        return h
+
+    @classmethod
+    def from_scores(cls, scores: dict, ts: float | None = None) -> ScoreHistory:
+        """从旧版 {unit: [pct, ...]} 迁移；旧数据没有时间戳，统一记为迁移时刻。"""
+        if ts is None:
+            ts = time.time()
+        h = cls()
+        for unit, pcts in scores.items():
+            for pct in pcts:
+                h.record(int(unit), pct, ts)
+        return h
@@ -0,0 +1,216 @@
+"""
+后台持久化队列 — 评分结果先展示，存储 I/O 交给专用线程。
+
+- 有界：最多 PERSIST_QUEUE_MAX 位用户同时排队，满时调用方短暂等待，
+  仍满则退回同步保存（背压，不丢数据）
+- 按用户合并：同一用户排队期间的多批增量变更按序拼接，一次写入
+- 失败重试：指数退避 + 抖动，用尽次数后标记 failed，任务保留到该用户下一次保存时并入；
+  事件带 id，后端跳过已应用的事件，「已写入但报错」的批次重试时不会重复计分
+- 进程退出时 flush（atexit）
+只依赖标准库。
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+from lib.storage import save_changes
+
+QUEUE_MAX = int(os.environ.get("PERSIST_QUEUE_MAX", "256"))
+MAX_ATTEMPTS = int(os.environ.get("PERSIST_MAX_ATTEMPTS", "5"))
+BASE_DELAY = 0.2
+MAX_DELAY = 10.0
+ENQUEUE_TIMEOUT = 2.0          # 队列满时调用方最多等待的秒数
+FLUSH_TIMEOUT = 10.0           # 进程退出时最多等待的秒数
+
+
+@dataclass
+class _Job:
+    """一位用户尚未落盘的增量变更（进度事件）。"""
+
+    user_id: str
+    events: list[dict]
+    attempts: int = 0
+    not_before: float = 0.0
+
+    def absorb(self, newer: _Job) -> None:
+        """并入同一用户更新的一批变更，按发生顺序追加在后。"""
+        self.events = self.events + newer.events
+        self.not_before = 0.0
+
+
+@dataclass
+class _Status:
+    state: str = "saved"        # "pending" | "saving" | "retrying" | "saved" | "failed"
+    saved_at: float | None = None
+    error: str = ""
+    attempts: int = 0
+
+
+# ---------------------------------------------------------------------------
+# 队列
+# ---------------------------------------------------------------------------
+class PersistQueue:
+    """按用户合并的有界保存队列，单个后台线程消费。"""
+
+    def __init__(self, maxsize: int = QUEUE_MAX) -> None:
+        self.maxsize = maxsize
+        self._pending: dict[str, _Job] = {}     # 插入顺序即处理顺序
+        self._failed: dict[str, _Job] = {}
+        self._status: dict[str, _Status] = {}
+        self._in_flight: str | None = None
+        self._cond = threading.Condition()
+        self._worker: threading.Thread | None = None
+
+    # -- 生产者 --
+    def submit(self, job: _Job) -> None:
+        with self._cond:
+            deadline = time.monotonic() + ENQUEUE_TIMEOUT
+            while True:
+                # 每次等待后都重新检查：等待期间同一用户（如共享的 DEFAULT_USER）可能已有任务入队或失败
+                failed = self._failed.pop(job.user_id, None)
+                if failed is not None:
+                    failed.absorb(job)
+                    failed.attempts = 0
+                    job = failed
+                pending = self._pending.get(job.user_id)
+                if pending is not None:
+                    pending.absorb(job)
+                    self._cond.notify_all()
+                    return
+                if len(self._pending) < self.maxsize:
+                    self._pending[job.user_id] = job
+                    self._status[job.user_id] = _Status("pending", self._saved_at(job.user_id))
+                    self._ensure_worker()
+                    self._cond.notify_all()
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        # 队列持续满：退回同步保存
+        self._save(job)
+
+    def _saved_at(self, user_id: str) -> float | None:
+        st = self._status.get(user_id)
+        return st.saved_at if st else None
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="persist-queue", daemon=True)
+            self._worker.start()
+
+    # -- 消费者 --
+    def _next_job(self) -> _Job:
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                ready = [j for j in self._pending.values() if j.not_before <= now]
+                if ready:
+                    job = self._pending.pop(ready[0].user_id)
+                    self._in_flight = job.user_id
+                    self._status[job.user_id].state = "saving"
+                    self._cond.notify_all()
+                    return job
+                waits = [j.not_before - now for j in self._pending.values()]
+                self._cond.wait(min(waits) if waits else None)
+
+    def _run(self) -> None:
+        while True:
+            job = self._next_job()
+            self._save(job)
+
+    def _save(self, job: _Job) -> None:
+        job.attempts += 1
+        try:
+            # 落盘后才报告 saved（文件后端的写后缓冲也要写出）
+            save_changes(job.user_id, job.events, sync=True)
+        except Exception as e:      # 存储后端的异常类型各不相同，统一重试
+            self._on_failure(job, e)
+        else:
+            with self._cond:
+                if job.user_id not in self._pending:
+                    self._status[job.user_id] = _Status("saved", time.time())
+                else:
+                    self._status[job.user_id].saved_at = time.time()
+        finally:
+            with self._cond:
+                if self._in_flight == job.user_id:
+                    self._in_flight = None
+                self._cond.notify_all()
+
+    def _on_failure(self, job: _Job, error: Exception) -> None:
+        with self._cond:
+            status = self._status.setdefault(job.user_id, _Status())
+            status.error = str(error)
+            status.attempts = job.attempts
+            newer = self._pending.pop(job.user_id, None)
+            if newer is not None:
+                job.absorb(newer)
+            if job.attempts >= MAX_ATTEMPTS:
+                # 保留任务，该用户下一次保存时并入重试
+                status.state = "failed"
+                self._failed[job.user_id] = job
+                return
+            delay = min(MAX_DELAY, BASE_DELAY * 2 ** (job.attempts - 1))
+            job.not_before = time.monotonic() + random.uniform(delay / 2, delay)
+            status.state = "retrying"
+            self._pending[job.user_id] = job
+
+    # -- 查询 / 等待 --
+    def status(self, user_id: str) -> dict:
+        with self._cond:
+            st = self._status.get(user_id, _Status())
+            return {
+                "state": st.state,
+                "saved_at": st.saved_at,
+                "error": st.error,
+                "attempts": st.attempts,
+            }
+
+    def wait(self, user_id: str | None = None, timeout: float = FLUSH_TIMEOUT) -> bool:
+        """等待某用户（或全部）排队中的保存完成；返回是否已全部落盘。"""
+        def idle() -> bool:
+            if user_id is None:
+                return not self._pending and self._in_flight is None
+            return user_id not in self._pending and self._in_flight != user_id
+
+        with self._cond:
+            for job in self._pending.values():
+                if user_id is None or job.user_id == user_id:
+                    job.not_before = 0.0    # 等待时跳过退避，立即重试（只限被等待的用户）
+            self._cond.notify_all()
+            done = self._cond.wait_for(idle, timeout)
+            if user_id is None:
+                return done and not self._failed
+            return done and user_id not in self._failed
+
+
+_queue = PersistQueue()
+
+
+# ---------------------------------------------------------------------------
+# 对外接口
+# ---------------------------------------------------------------------------
+def enqueue_changes(user_id: str, events: list[dict]) -> None:
+    """提交一批增量变更（见 save_changes）；立即返回，由后台线程写入。"""
+    if events:
+        _queue.submit(_Job(user_id, list(events)))
+
+
+def save_status(user_id: str) -> dict:
+    """该用户最近一次保存的状态：state / saved_at / error / attempts。"""
+    return _queue.status(user_id)
+
+
+def wait_saved(user_id: str | None = None, timeout: float = FLUSH_TIMEOUT) -> bool:
+    """阻塞到该用户（默认全部用户）排队中的保存完成或超时。"""
+    return _queue.wait(user_id, timeout)
+
+
+atexit.register(wait_saved)
@@ -0,0 +1,355 @@
+"""
+进度数据结构 — 分数聚合、弱点存储，以及按事件重放进度文档。
+
+纯数据逻辑，不依赖 streamlit；state（会话）与 storage（事件日志重放）共用。
+"""
+
+from __future__ import annotations
+
+import time
+import uuid
+from collections import deque
+
+from lib.history import ScoreHistory
+
+# 模考记录在进度文档中保留的条数
+EXAMS_KEPT = 50
+# 进度文档记住的最近已应用事件 id 数：保存失败重试时跳过已写入的事件。
+# 重试只会重发最近一批（一次 quiz = 1 个分数 + 每题至多 1 个弱点事件），64 个足够覆盖
+APPLIED_KEPT = 64
+EVENT_ID_BYTES = 4             # 事件 id 为 8 位十六进制，编码时按原始字节打包
+
+
+# ---------------------------------------------------------------------------
+# 进度聚合 — 写入时增量维护
+# ---------------------------------------------------------------------------
+class ProgressStats:
+    """
+    分数的运行聚合：总次数、总和、每单元 (次数, 总和, 最高分)、最近 N 次滑动窗口。
+
+    record() 为 O(1)；页面渲染直接读取，不再遍历 scores 历史。
+    """
+
+    WINDOW = 10
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0
+        self.units: dict[int, dict] = {}   # {unit_number: {"count", "sum", "best"}}
+        self.recent: deque[int] = deque(maxlen=self.WINDOW)
+
+    def record(self, unit: int, pct: int) -> None:
+        """记录一次 quiz 分数。"""
+        self.count += 1
+        self.total += pct
+        u = self.units.get(unit)
+        if u is None:
+            self.units[unit] = {"count": 1, "sum": pct, "best": pct}
+        else:
+            u["count"] += 1
+            u["sum"] += pct
+            u["best"] = max(u["best"], pct)
+        self.recent.append(pct)
+
+    # -- 查询 --
+    @property
+    def avg(self) -> int:
+        return round(self.total / self.count) if self.count else 0
+
+    @property
+    def recent_avg(self) -> int:
+        return round(sum(self.recent) / len(self.recent)) if self.recent else 0
+
+    @property
+    def units_done(self) -> int:
+        return len(self.units)
+
+    def best(self, unit: int) -> int | None:
+        u = self.units.get(unit)
+        return u["best"] if u else None
+
+    # -- 序列化 --
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "units": self.units,
+            "recent": list(self.recent),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> ProgressStats:
+        stats = cls()
+        stats.count = data.get("count", 0)
+        stats.total = data.get("total", 0)
+        # JSON key 是字符串，转回 int
+        stats.units = {int(k): dict(v) for k, v in data.get("units", {}).items()}
+        stats.recent.extend(data.get("recent", []))
+        return stats
+
+    @classmethod
+    def from_scores(cls, scores: dict) -> ProgressStats:
+        """从完整分数历史重建（旧数据迁移用；滑动窗口按单元顺序近似）。"""
+        stats = cls()
+        for unit, pcts in scores.items():
+            for pct in pcts:
+                stats.record(int(unit), pct)
+        return stats
+
+
+# ---------------------------------------------------------------------------
+# 弱点存储 — 哈希索引（主键 + 单元二级索引）
+# ---------------------------------------------------------------------------
+class WeakPointStore:
+    """
+    弱点集合：按 (type, unit, key) 哈希索引，另按 unit 建二级索引。
+
+    增、减、删均为 O(1)；按单元取弱点只访问该单元的条目。
+    dict 保持插入顺序，to_list() 与旧版 list 格式完全一致（整文档保存即用此格式）。
+    """
+
+    def __init__(self, items: list[dict] | None = None) -> None:
+        self._items: dict[tuple, dict] = {}
+        self._by_unit: dict[int, dict[tuple, dict]] = {}
+        self._type_counts: dict[str, int] = {}
+        for wp in items or []:
+            self._insert(_wp_key(wp), wp)
+
+    # -- 内部 --
+    def _insert(self, k: tuple, wp: dict) -> None:
+        self._items[k] = wp
+        self._by_unit.setdefault(k[1], {})[k] = wp
+        self._type_counts[k[0]] = self._type_counts.get(k[0], 0) + 1
+
+    def _remove(self, k: tuple) -> None:
+        del self._items[k]
+        unit_items = self._by_unit[k[1]]
+        del unit_items[k]
+        if not unit_items:
+            del self._by_unit[k[1]]
+        self._type_counts[k[0]] -= 1
+
+    # -- 操作 --
+    def add(self, wp_type: str, unit: int, key: str, item: str) -> None:
+        """添加弱点，已存在则 fail_count +1。"""
+        k = (wp_type, unit, key)
+        wp = self._items.get(k)
+        if wp is not None:
+            wp["fail_count"] = wp.get("fail_count", 1) + 1
+            return
+        self._insert(k, {
+            "type": wp_type,
+            "unit": unit,
+            "key": key,
+            "item": item[:80],
+            "fail_count": 1,
+        })
+
+    def reduce(self, wp_type: str, unit: int, key: str) -> None:
+        """做对时减少 fail_count，归零则移除。"""
+        k = (wp_type, unit, key)
+        wp = self._items.get(k)
+        if wp is None:
+            return
+        wp["fail_count"] = wp.get("fail_count", 1) - 1
+        if wp["fail_count"] <= 0:
+            self._remove(k)
+
+    # -- 查询 --
+    def for_unit(self, unit: int) -> list[dict]:
+        """指定单元的弱点（插入顺序）。"""
+        return list(self._by_unit.get(unit, {}).values())
+
+    def count_type(self, wp_type: str) -> int:
+        return self._type_counts.get(wp_type, 0)
+
+    def to_list(self) -> list[dict]:
+        """序列化为持久化用的 list 格式。"""
+        return list(self._items.values())
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items.values())
+
+    def __bool__(self) -> bool:
+        return bool(self._items)
+
+
+def _wp_key(wp: dict) -> tuple:
+    """弱点唯一标识。"""
+    return (wp.get("type", ""), wp.get("unit", 0), wp.get("key", ""))
+
+
+# ---------------------------------------------------------------------------
+# AI 评分聚合 — 读取模考记录中的结构化分数
+# ---------------------------------------------------------------------------
+# 技能 → 记录这项技能评分的记录类型（exam_blanc 的写作分数在 "writing" 字段）
+RUBRIC_KINDS = {"oral": ("oral", "exam_po"), "writing": ("writing", "exam_pe", "exam_blanc")}
+SKILL_WINDOW = 5
+
+
+def skill_scores(exams: list[dict]) -> dict[str, float | None]:
+    """口语 / 写作最近 SKILL_WINDOW 次评分的平均得分率（0-1）；没有评分记录时为 None。"""
+    out: dict[str, float | None] = {}
+    for skill, kinds in RUBRIC_KINDS.items():
+        ratios = []
+        for e in reversed(exams):
+            if e.get("kind") not in kinds:
+                continue
+            rubric = e.get("writing") if e["kind"] == "exam_blanc" else e
+            if isinstance(rubric, dict) and rubric.get("max"):
+                ratios.append(rubric["total"] / rubric["max"])
+                if len(ratios) == SKILL_WINDOW:
+                    break
+        out[skill] = sum(ratios) / len(ratios) if ratios else None
+    return out
+
+
+# ---------------------------------------------------------------------------
+# 事件重放
+# ---------------------------------------------------------------------------
+def make_event(event: str, ts: float | None = None, **fields) -> dict:
+    """构造一条进度事件（格式见 apply_events），带唯一 id，重复写入时按 id 去重。"""
+    return {
+        "event": event, "id": uuid.uuid4().hex[:EVENT_ID_BYTES * 2],
+        "ts": time.time() if ts is None else ts, **fields,
+    }
+
+
+def exam_record(ev: dict) -> dict:
+    """exam_completed 事件 → 模考记录（去掉事件元数据）。"""
+    return {k: v for k, v in ev.items() if k not in ("event", "id")}
+
+
+def apply_events(data: dict, events) -> dict:
+    """
+    把事件依次应用到进度文档上，返回新文档。
+
+    事件格式：{"event": <类型>, "id": <事件 id>, "ts": <时间戳>, ...}
+    id 已在文档的 applied（最近 APPLIED_KEPT 个）中的事件跳过，重试写入不会重复计分；
+    旧版无 id 的事件照常应用。
+    - quiz_graded:        unit, pct
+    - weak_point_added:   type, unit, key, item
+    - weak_point_reduced: type, unit, key
+    - exam_completed:     kind 及各项分数（保留最近 EXAMS_KEPT 条）；
+                          AI 评分另带 unit、作答摘要 submission 与结构化分数 criteria / total / max
+    """
+    legacy = {int(k): v for k, v in data.get("scores", {}).items()}
+    if data.get("history"):
+        history = ScoreHistory.from_dict(data["history"])
+    else:
+        # 旧版 {unit: [pct, ...]} 只有这一份，重放前先迁移
+        history = ScoreHistory.from_scores(legacy)
+    if data.get("stats"):
+        stats = ProgressStats.from_dict(data["stats"])
+    else:
+        stats = ProgressStats.from_scores(legacy)
+    weak = WeakPointStore([dict(wp) for wp in data.get("weak_points", [])])
+    exams = list(data.get("exams", []))
+    applied = list(data.get("applied", []))
+    seen = set(applied)
+
+    for ev in events:
+        event_id = ev.get("id")
+        if event_id is not None:
+            if event_id in seen:
+                continue
+            seen.add(event_id)
+            applied.append(event_id)
+        kind = ev.get("event")
+        if kind == "quiz_graded":
+            history.record(ev["unit"], ev["pct"], ev.get("ts"))
+            stats.record(ev["unit"], ev["pct"])
+        elif kind == "weak_point_added":
+            weak.add(ev["type"], ev["unit"], ev["key"], ev.get("item", ""))
+        elif kind == "weak_point_reduced":
+            weak.reduce(ev["type"], ev["unit"], ev["key"])
+        elif kind == "exam_completed":
+            exams.append(exam_record(ev))
+
+    out = dict(data)
+    out.pop("scores", None)
+    out["history"] = history.to_dict()
+    out["stats"] = stats.to_dict()
+    out["weak_points"] = weak.to_list()
+    out["exams"] = exams[-EXAMS_KEPT:]
+    out["applied"] = applied[-APPLIED_KEPT:]
+    return out
+
+
+# ---------------------------------------------------------------------------
+# 并发合并
+# ---------------------------------------------------------------------------
+def merge_progress(local: dict, remote: dict, ancestor: dict | None = None) -> dict:
+    """
+    两份进度文档的字段级合并（并发写冲突时使用）；ancestor 为 local 修改前读到的版本。
+
+    - history: 以 remote 为底，并入 local 缓冲中 remote 没有的作答（按时间重建缓冲）
+    - stats:   随补上的作答同步累加，保持与 history 一致
+    - weak_points: 有 ancestor 时三方合并——把 local 相对 ancestor 的 fail_count 增减叠加到 remote 上，
+                   归零即删除（本地做对删掉的弱点不会被 remote 带回来）；
+                   没有 ancestor 时按 (type, unit, key) 合并，fail_count 取较大值
+    - exams:   按时间戳并集
+    - applied: 已应用事件 id 并集
+    """
+    base = ScoreHistory.from_dict(remote["history"]) if remote.get("history") else ScoreHistory()
+    stats = ProgressStats.from_dict(remote["stats"]) if remote.get("stats") else ProgressStats()
+
+    attempts = [(int(ts), u, p) for ts, u, p in base.recent()]
+    seen = set(attempts)
+    # 缓冲已满才会有作答被折叠进汇总：比最早一条还旧的作答可能已计入，不再补
+    full = len(base) == base.ring_size
+    oldest = attempts[0][0] if full else float("-inf")
+    if local.get("history"):
+        for ts, unit, pct in ScoreHistory.from_dict(local["history"]).recent():
+            a = (int(ts), unit, pct)
+            if a[0] > oldest and a not in seen:
+                attempts.append(a)
+                seen.add(a)
+                stats.record(unit, pct)
+
+    # 按时间重建缓冲，溢出部分照常折叠进汇总
+    history = ScoreHistory(base.ring_size)
+    history.daily, history.weekly = base.daily, base.weekly
+    for ts, unit, pct in sorted(attempts):
+        history.record(unit, pct, ts)
+
+    if ancestor is not None:
+        weak = _merge_weak_points(local, remote, ancestor)
+    else:
+        weak = {}
+        for wp in remote.get("weak_points", []) + local.get("weak_points", []):
+            k = _wp_key(wp)
+            if k not in weak or wp.get("fail_count", 1) > weak[k].get("fail_count", 1):
+                weak[k] = dict(wp)
+
+    exams = {e.get("ts"): e for e in remote.get("exams", []) + local.get("exams", [])}
+
+    out = {**remote, **local}
+    out["history"] = history.to_dict()
+    out["stats"] = stats.to_dict()
+    out["weak_points"] = list(weak.values())
+    out["exams"] = sorted(exams.values(), key=lambda e: e.get("ts") or 0)[-EXAMS_KEPT:]
+    applied = remote.get("applied", [])
+    seen = set(applied)
+    applied = applied + [i for i in local.get("applied", []) if i not in seen]
+    out["applied"] = applied[-APPLIED_KEPT:]
+    return out
+
+
+def _merge_weak_points(local: dict, remote: dict, ancestor: dict) -> dict[tuple, dict]:
+    """弱点三方合并：remote + (local - ancestor)，fail_count 归零的删除。"""
+    before = {_wp_key(wp): wp.get("fail_count", 1) for wp in ancestor.get("weak_points", [])}
+    after = {_wp_key(wp): wp for wp in local.get("weak_points", [])}
+    weak = {_wp_key(wp): dict(wp) for wp in remote.get("weak_points", [])}
+    for k in list(before) + [k for k in after if k not in before]:
+        delta = (after[k].get("fail_count", 1) if k in after else 0) - before.get(k, 0)
+        if not delta:
+            continue
+        if k in weak:
+            weak[k]["fail_count"] = weak[k].get("fail_count", 1) + delta
+        elif delta > 0:
+            weak[k] = {**after[k], "fail_count": delta}
+    return {k: wp for k, wp in weak.items() if wp.get("fail_count", 1) > 0}
@@ -29,6 +29,27 @@ def _trans_key(t: dict) -> str:
     return f"{t['type']}|{t['source'][:30]}"
 
 
+def weak_item_texts(unit: dict) -> dict[tuple[str, str], tuple[str, ...]]:
+    """
+    单元内每个题目 _key 可能记入弱点的题面文本（截断到 80 字符）。
+
+    返回 {(弱点类型, _key): (文本, ...)}，供进度编码把弱点题面替换为语料引用。
+    """
+    texts: dict[tuple[str, str], tuple[str, ...]] = {}
+    for v in unit.get("vocabulary", []):
+        texts["vocabulary", _vocab_key(v)] = (
+            v["definition"][:80],
+            f"Quelle est la définition de « {v['word']} » ?"[:80],
+        )
+    for e in unit.get("expressions", []):
+        texts["expression", _expr_key(e)] = (e["usage"][:80],)
+    for c in unit.get("conjugation_list", []):
+        texts["conjugation", _conj_key(c)] = (f"{c['verb']} — {c['tense']} — {c['person']}"[:80],)
+    for t in unit.get("grammar_transforms", []):
+        texts["grammar", _trans_key(t)] = (t["source"][:80],)
+    return texts
+
+
 # ---------------------------------------------------------------------------
 # 按比例分配题目数量（保留原始逻辑）
 # ---------------------------------------------------------------------------
@@ -117,7 +138,7 @@ def generate_unit_quiz(
     参数:
         unit: 当前单元数据
         all_units: 全部单元列表（用于 MCQ 干扰项）
-        weak_points: 弱点列表（可选，用于间隔重复）
+        weak_points: 弱点列表（可选，用于间隔重复；传入当前单元的子集即可）
 
     返回:
         {"vocab": [...], "expr": [...], "conj": [...], "trans": [...]}
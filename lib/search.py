@@ -0,0 +1,132 @@
+"""
+全文检索 — 语料倒排索引（去重音 + 前缀匹配）。
+
+加载时对全部单元的 vocabulary / vocabulary_list / expressions / grammar_transforms
+建立一次倒排索引，之后每次查询只做词项查找和集合求交，不再扫描语料。
+只依赖标准库。
+"""
+
+from __future__ import annotations
+
+import re
+from bisect import bisect_left
+from dataclasses import dataclass, field
+
+from lib.matching import _normalize_apostrophe, _strip_accents
+
+# 分词：撇号、连字符、标点和空白都视为分隔符（l'environnement → l / environnement）
+_TOKEN_RE = re.compile(r"[^\W_]+")
+
+# 条目类型展示顺序
+KIND_ORDER = ("expression", "vocabulary", "vocabulary_list", "grammar")
+
+
+# ---------------------------------------------------------------------------
+# 文本折叠
+# ---------------------------------------------------------------------------
+def fold(text: str) -> str:
+    """casefold + 去重音 + 统一撇号，与 matching 的容差规则一致。"""
+    return _strip_accents(_normalize_apostrophe(text).casefold())
+
+
+def tokenize(text: str) -> list[str]:
+    """折叠后切分为词项。"""
+    return _TOKEN_RE.findall(fold(text))
+
+
+# ---------------------------------------------------------------------------
+# 索引结构
+# ---------------------------------------------------------------------------
+@dataclass(frozen=True)
+class SearchEntry:
+    """一条可检索的语料条目。"""
+
+    unit: int
+    kind: str        # "vocabulary" | "vocabulary_list" | "expression" | "grammar"
+    title: str       # 主文本（词 / 表达 / 原句）
+    detail: str      # 补充文本（释义 / 例句 / 改写答案）
+
+
+@dataclass
+class SearchIndex:
+    """倒排索引：词项 → 条目 id 集合，外加排序词表用于前缀查找。"""
+
+    entries: list[SearchEntry] = field(default_factory=list)
+    postings: dict[str, set[int]] = field(default_factory=dict)
+    folded: list[tuple[str, str]] = field(default_factory=list)  # (标题, 全文) 折叠后，短语加权用
+    terms: list[str] = field(default_factory=list)    # 排序后的词表
+
+    def add(self, entry: SearchEntry) -> None:
+        doc_id = len(self.entries)
+        self.entries.append(entry)
+        text = f"{entry.title} {entry.detail}"
+        self.folded.append((" ".join(tokenize(entry.title)), " ".join(tokenize(text))))
+        for tok in set(tokenize(text)):
+            self.postings.setdefault(tok, set()).add(doc_id)
+
+    def finalize(self) -> None:
+        """构建完成后调用，生成排序词表。"""
+        self.terms = sorted(self.postings)
+
+    def _prefix_docs(self, prefix: str) -> set[int]:
+        """返回所有以 prefix 开头的词项对应的条目 id 并集。"""
+        docs: set[int] = set()
+        i = bisect_left(self.terms, prefix)
+        while i < len(self.terms) and self.terms[i].startswith(prefix):
+            docs |= self.postings[self.terms[i]]
+            i += 1
+        return docs
+
+    def search(self, query: str, limit: int = 50) -> list[SearchEntry]:
+        """
+        查询：前面的词精确匹配，最后一个词按前缀匹配（边输边查）。
+
+        结果排序：标题包含查询短语 > 全文包含查询短语 > 其余，再按类型、单元。
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        *exact, last = tokens
+        candidate: set[int] | None = None
+        for tok in exact:
+            docs = self.postings.get(tok, set())
+            candidate = docs if candidate is None else candidate & docs
+            if not candidate:
+                return []
+        prefix_docs = self._prefix_docs(last)
+        candidate = prefix_docs if candidate is None else candidate & prefix_docs
+
+        phrase = " ".join(tokens)
+        kind_rank = {k: i for i, k in enumerate(KIND_ORDER)}
+        ranked = sorted(
+            candidate,
+            key=lambda d: (
+                phrase not in self.folded[d][0],
+                phrase not in self.folded[d][1],
+                kind_rank.get(self.entries[d].kind, len(KIND_ORDER)),
+                self.entries[d].unit,
+                d,
+            ),
+        )
+        return [self.entries[d] for d in ranked[:limit]]
+
+
+# ---------------------------------------------------------------------------
+# 从 data.json 构建
+# ---------------------------------------------------------------------------
+def build_search_index(units: list[dict]) -> SearchIndex:
+    """遍历全部单元语料，建立倒排索引。"""
+    index = SearchIndex()
+    for u in units:
+        n = u["unit_number"]
+        for v in u.get("vocabulary", []):
+            index.add(SearchEntry(n, "vocabulary", v["word"], v.get("definition", "")))
+        for term in u.get("vocabulary_list", []):
+            index.add(SearchEntry(n, "vocabulary_list", term, ""))
+        for e in u.get("expressions", []):
+            index.add(SearchEntry(n, "expression", e["expression"], e.get("example", "")))
+        for t in u.get("grammar_transforms", []):
+            index.add(SearchEntry(n, "grammar", t["source"], t.get("answer", "")))
+    index.finalize()
+    return index
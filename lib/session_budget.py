@@ -0,0 +1,246 @@
+"""
+Session state 内存预算 — 统计各键占用，超预算时把冷数据溢出到本地磁盘。
+
+- 统计范围：init_state 注册的全部键（STATE_KEYS）
+- 冷数据：不属于当前页面的键（见 PAGE_KEYS）
+- 溢出顺序：SPILL_ORDER（音频优先），同优先级内先溢出体积大的
+- 回填：渲染某页面前，把该页面的溢出键从磁盘读回
+- 溢出目录默认在 DATA_DIR/spill，目录 0o700、文件 0o600；目录不归本进程用户所有
+  或对其他用户可写时既不溢出也不回填（pickle 读回即执行，不能信任他人放进来的文件）
+"""
+
+from __future__ import annotations
+
+import os
+import pickle
+import sys
+import time
+from pathlib import Path
+
+import streamlit as st
+
+from lib.state import EXAM_BLANC_STATE_KEYS, STATE_KEYS, UNIT_STATE_KEYS
+from lib.storage import DATA_DIR
+
+# ---------------------------------------------------------------------------
+# 配置
+# ---------------------------------------------------------------------------
+BUDGET_BYTES = int(os.environ.get("SESSION_STATE_BUDGET_KB", "256")) * 1024
+SPILL_DIR = Path(os.environ.get("SPILL_DIR", DATA_DIR / "spill"))
+SPILL_TTL = 24 * 3600          # 超过此时长未回填的溢出文件视为孤儿，清理
+SESSION_TTL = 3600             # 超过此时长未活动的会话不计入进程统计
+
+# 页面 → 该页面渲染时会读取的重数据键
+PAGE_KEYS: dict[str, tuple[str, ...]] = {
+    "unit": UNIT_STATE_KEYS,
+    "exam_blanc": EXAM_BLANC_STATE_KEYS,
+}
+
+# 可溢出的键，按优先级排列（音频最先）
+SPILL_ORDER = (
+    "exam_co_audio",
+    "exam_co_data",
+    "exam_ce_data",
+    "quiz_results",
+    "exam_blanc_results",
+    "oral_grade",
+    "writing_grade",
+    "exam_pe_grade",
+    "exam_po_grade",
+    "exam_blanc_writing_grade",
+)
+
+# 进程内各会话的占用 {session_id: (bytes, last_seen)}
+_SESSION_SIZES: dict[str, tuple[int, float]] = {}
+
+
+class Spilled:
+    """已溢出到磁盘的占位符。"""
+
+    __slots__ = ("path", "size")
+
+    def __init__(self, path: Path, size: int) -> None:
+        self.path = path
+        self.size = size
+
+    def __repr__(self) -> str:
+        return f"Spilled({self.path.name}, {self.size} B)"
+
+
+# ---------------------------------------------------------------------------
+# 体积统计
+# ---------------------------------------------------------------------------
+def deep_sizeof(obj, _seen: set[int] | None = None) -> int:
+    """递归估算对象占用字节数（容器 + 元素，已访问对象只计一次）。"""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    if isinstance(obj, Spilled):
+        return sys.getsizeof(obj)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, _seen) + deep_sizeof(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(x, _seen) for x in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), _seen)
+    return size
+
+
+def measure_state() -> dict[str, int]:
+    """init_state 注册的每个键在内存中的占用（字节）。"""
+    return {
+        k: deep_sizeof(st.session_state[k])
+        for k in STATE_KEYS
+        if k in st.session_state
+    }
+
+
+def _session_id() -> str:
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+        ctx = get_script_run_ctx()
+        if ctx is not None:
+            return ctx.session_id
+    except ImportError:
+        pass
+    return "local"
+
+
+# ---------------------------------------------------------------------------
+# 溢出 / 回填
+# ---------------------------------------------------------------------------
+def _private(path: Path) -> bool:
+    """path 归本进程用户所有，且组 / 其他用户无任何权限（不支持 uid 的平台只查存在）。"""
+    try:
+        info = path.lstat()
+    except OSError:
+        return False
+    if not hasattr(os, "getuid"):
+        return True
+    return info.st_uid == os.getuid() and not info.st_mode & 0o077
+
+
+def _private_dir(path: Path) -> bool:
+    """建好私有目录（0o700）；已存在但不私有时返回 False。"""
+    try:
+        path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    except OSError:
+        return False
+    return path.is_dir() and not path.is_symlink() and _private(path)
+
+
+def _spill(key: str, size: int) -> bool:
+    session_dir = SPILL_DIR / _session_id()
+    if not (_private_dir(SPILL_DIR) and _private_dir(session_dir)):
+        return False
+    path = session_dir / f"{key}.pkl"
+    path.unlink(missing_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump(st.session_state[key], f, protocol=pickle.HIGHEST_PROTOCOL)
+    st.session_state[key] = Spilled(path, size)
+    return True
+
+
+def _rehydrate(key: str) -> None:
+    val = st.session_state.get(key)
+    if not isinstance(val, Spilled):
+        return
+    try:
+        if not (_private(SPILL_DIR) and _private(val.path.parent) and _private(val.path)):
+            raise OSError(f"溢出文件不可信：{val.path}")
+        with open(val.path, "rb") as f:
+            st.session_state[key] = pickle.load(f)
+        val.path.unlink(missing_ok=True)
+    except (OSError, pickle.UnpicklingError):
+        # 文件丢失（容器重启 / 被清理）或不可信 → 视为未生成，页面会提示重新生成
+        st.session_state[key] = None
+
+
+def discard(key: str) -> None:
+    """键被重置时删除其溢出文件（否则要等 SPILL_TTL 后才被清理）。"""
+    val = st.session_state.get(key)
+    if isinstance(val, Spilled):
+        val.path.unlink(missing_ok=True)
+
+
+def _purge_stale() -> None:
+    """删除过期的孤儿溢出文件（会话已结束、从未回填）。"""
+    if not SPILL_DIR.exists():
+        return
+    cutoff = time.time() - SPILL_TTL
+    for path in SPILL_DIR.glob("*/*.pkl"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError:
+            pass
+
+
+def enforce_budget(page: str) -> dict:
+    """
+    每次渲染前调用：回填当前页面的键，超预算时溢出其他页面的冷数据。
+
+    返回 session_report() 的结果。
+    """
+    hot = set(PAGE_KEYS.get(page, ()))
+    for key in hot:
+        _rehydrate(key)
+
+    sizes = measure_state()
+    total = sum(sizes.values())
+    if total > BUDGET_BYTES:
+        rank = {k: i for i, k in enumerate(SPILL_ORDER)}
+        cold = sorted(
+            (k for k in SPILL_ORDER
+             if k not in hot
+             and st.session_state.get(k) is not None
+             and not isinstance(st.session_state.get(k), Spilled)),
+            key=lambda k: (rank[k], -sizes.get(k, 0)),
+        )
+        for key in cold:
+            if total <= BUDGET_BYTES:
+                break
+            if not _spill(key, sizes[key]):
+                break           # 溢出目录不可用：本次不溢出
+            total -= sizes[key] - deep_sizeof(st.session_state[key])
+        _purge_stale()
+
+    _SESSION_SIZES[_session_id()] = (total, time.time())
+    return session_report(measure_state() if total != sum(sizes.values()) else sizes)
+
+
+# ---------------------------------------------------------------------------
+# 报告
+# ---------------------------------------------------------------------------
+def session_report(sizes: dict[str, int] | None = None) -> dict:
+    """当前会话占用：内存中各键大小、已溢出键大小。"""
+    if sizes is None:
+        sizes = measure_state()
+    spilled = {
+        k: st.session_state[k].size
+        for k in STATE_KEYS
+        if isinstance(st.session_state.get(k), Spilled)
+    }
+    return {
+        "total": sum(sizes.values()),
+        "budget": BUDGET_BYTES,
+        "keys": dict(sorted(sizes.items(), key=lambda kv: kv[1], reverse=True)),
+        "spilled": spilled,
+    }
+
+
+def process_report() -> dict:
+    """进程内所有活跃会话的占用汇总。"""
+    cutoff = time.time() - SESSION_TTL
+    for sid, (_size, seen) in list(_SESSION_SIZES.items()):
+        if seen < cutoff:
+            del _SESSION_SIZES[sid]
+    return {
+        "sessions": len(_SESSION_SIZES),
+        "total": sum(size for size, _seen in _SESSION_SIZES.values()),
+    }
@@ -6,18 +6,26 @@ from __future__ import annotations
 
 import streamlit as st
 
+from lib.history import ScoreHistory
+from lib.progress import EXAMS_KEPT, ProgressStats, WeakPointStore, exam_record, make_event
+from lib.storage import DEFAULT_USER
+
 
 # ---------------------------------------------------------------------------
 # 初始化
 # ---------------------------------------------------------------------------
-def init_state():
-    """设置所有 session_state 默认值。"""
-    defaults = {
+def _state_defaults() -> dict:
+    """所有 session_state 键及其默认值。"""
+    return {
         "openrouter_api_key": "",
+        "user_id": DEFAULT_USER,
         "current_page": "home",
         "current_unit": None,
-        "scores": {},               # {unit_number: [pct, pct, ...]}
-        "weak_points": [],           # [{"type", "unit", "key", "item", "fail_count"}, ...]
+        "score_history": ScoreHistory(),   # 有界历史：最近作答 + 日/周汇总
+        "progress_stats": ProgressStats(),
+        "weak_points": WeakPointStore(),  # 序列化为 [{"type", "unit", "key", "item", "fail_count"}, ...]
+        "exams": [],                 # 最近的模考 / 评分记录（含结构化分数），按时间顺序
+        "pending_events": [],        # 尚未持久化的进度事件（日志型后端用）
         "quiz_questions": [],
         "quiz_answers": {},
         "quiz_submitted": False,
@@ -39,7 +47,25 @@ def init_state():
         "exam_blanc_results": None,
         "exam_blanc_writing_grade": None,
     }
-    for k, v in defaults.items():
+
+
+# 按页面归组的状态键（切换页面 / 内存预算用）
+UNIT_STATE_KEYS = (
+    "quiz_questions", "quiz_answers", "quiz_submitted", "quiz_results",
+    "oral_grade", "writing_grade",
+    "exam_co_data", "exam_co_audio", "exam_ce_data",
+    "exam_co_submitted", "exam_ce_submitted",
+    "exam_co_score", "exam_ce_score", "exam_pe_grade", "exam_po_grade",
+)
+EXAM_BLANC_STATE_KEYS = (
+    "exam_blanc_data", "exam_blanc_start_time", "exam_blanc_submitted",
+    "exam_blanc_results", "exam_blanc_writing_grade",
+)
+
+
+def init_state():
+    """设置所有 session_state 默认值。"""
+    for k, v in _state_defaults().items():
         if k not in st.session_state:
             st.session_state[k] = v
 
@@ -48,14 +74,11 @@ def init_state():
 # 重置单元状态
 # ---------------------------------------------------------------------------
 def reset_unit_state():
-    """切换单元时清空当前做题状态。"""
-    for key in [
-        "quiz_questions", "quiz_answers", "quiz_submitted", "quiz_results",
-        "oral_grade", "writing_grade",
-        "exam_co_data", "exam_co_audio", "exam_ce_data",
-        "exam_co_submitted", "exam_ce_submitted",
-        "exam_co_score", "exam_ce_score", "exam_pe_grade", "exam_po_grade",
-    ]:
+    """切换单元时清空当前做题状态（连同已溢出到磁盘的文件）。"""
+    from lib.session_budget import discard     # session_budget 依赖本模块，延迟导入
+
+    for key in UNIT_STATE_KEYS:
+        discard(key)
         val = st.session_state.get(key)
         if isinstance(val, (list, dict)):
             st.session_state[key] = type(val)()
@@ -67,41 +90,59 @@ def reset_unit_state():
 
 
 # ---------------------------------------------------------------------------
-# 弱点管理 — 升级版（带去重 + fail_count）
+# 进度事件 — 供日志型存储后端追加写入
+# ---------------------------------------------------------------------------
+def _emit(event: str, **fields) -> None:
+    st.session_state.pending_events.append(make_event(event, **fields))
+
+
+def drain_events() -> list[dict]:
+    """取出并清空本会话尚未持久化的事件。"""
+    events = st.session_state.pending_events
+    st.session_state.pending_events = []
+    return events
+
+
+def record_exam(kind: str, **scores) -> None:
+    """记录一次模考完成或一次 AI 评分（结构化分数）。"""
+    event = make_event("exam_completed", kind=kind, **scores)
+    st.session_state.pending_events.append(event)
+    exams = st.session_state.exams
+    exams.append(exam_record(event))
+    del exams[:-EXAMS_KEPT]
+
+
 # ---------------------------------------------------------------------------
-def _wp_key(wp: dict) -> tuple:
-    """弱点唯一标识。"""
-    return (wp.get("type", ""), wp.get("unit", 0), wp.get("key", ""))
+# 分数记录
+# ---------------------------------------------------------------------------
+def record_score(unit: int, pct: int) -> None:
+    """追加 quiz 分数并同步更新聚合。"""
+    st.session_state.score_history.record(unit, pct)
+    st.session_state.progress_stats.record(unit, pct)
+    _emit("quiz_graded", unit=unit, pct=pct)
 
 
+# ---------------------------------------------------------------------------
+# 弱点管理 — 升级版（带去重 + fail_count）
+# ---------------------------------------------------------------------------
 def add_weak_point(wp_type: str, unit: int, key: str, item: str):
     """添加弱点，已存在则 fail_count +1。"""
-    for wp in st.session_state.weak_points:
-        if _wp_key(wp) == (wp_type, unit, key):
-            wp["fail_count"] = wp.get("fail_count", 1) + 1
-            return
-    st.session_state.weak_points.append({
-        "type": wp_type,
-        "unit": unit,
-        "key": key,
-        "item": item[:80],
-        "fail_count": 1,
-    })
+    st.session_state.weak_points.add(wp_type, unit, key, item)
+    _emit("weak_point_added", type=wp_type, unit=unit, key=key, item=item[:80])
 
 
 def reduce_weak_point(wp_type: str, unit: int, key: str):
     """做对时减少 fail_count，归零则移除。"""
-    target_key = (wp_type, unit, key)
-    for i, wp in enumerate(st.session_state.weak_points):
-        if _wp_key(wp) == target_key:
-            wp["fail_count"] = wp.get("fail_count", 1) - 1
-            if wp["fail_count"] <= 0:
-                st.session_state.weak_points.pop(i)
-            return
+    st.session_state.weak_points.reduce(wp_type, unit, key)
+    _emit("weak_point_reduced", type=wp_type, unit=unit, key=key)
 
 
 def get_weak_items_for_unit(unit: int) -> list[dict]:
     """获取指定单元的弱点列表（按 fail_count 降序）。"""
-    items = [wp for wp in st.session_state.weak_points if wp.get("unit") == unit]
+    items = st.session_state.weak_points.for_unit(unit)
     items.sort(key=lambda w: w.get("fail_count", 0), reverse=True)
     return items
+
+
+# init_state 注册的全部键（内存预算统计用）
+STATE_KEYS: tuple[str, ...] = tuple(_state_defaults())
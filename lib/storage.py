@@ -1,109 +1,1027 @@
 """
-持久化存储层 — 支持本地文件和 S3 两种后端。
+持久化存储层 — 支持本地文件、S3、追加式事件日志和 SQLite 四种后端。
+
+进度按用户分片存储：每位学习者一个小文档，保存时只读写自己的记录。
 """
 
 from __future__ import annotations
 
+import atexit
+import copy
+import hashlib
 import json
 import os
+import queue
+import random
+import re
+import tempfile
+import threading
+import time
 from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
 from pathlib import Path
 
+from lib.codec import ProgressDecodeError, decode_progress, encode_progress
+from lib.matching import _strip_accents
+from lib.progress import APPLIED_KEPT, apply_events, exam_record, make_event, merge_progress
+
+# 未填写用户名时使用；同时承接旧版单文件进度
+DEFAULT_USER = "default"
+
+# 本地后端（文件 / 事件日志 / SQLite）的数据根目录
+DATA_DIR = Path(os.environ.get("PROGRESS_DATA_DIR", Path(__file__).resolve().parent.parent / "data"))
+
+_USER_ID_RE = re.compile(r"[^a-z0-9_-]+")
+
+
+def normalize_user_id(name: str) -> str:
+    """用户名 → 存储用 id（小写、仅保留 a-z0-9_-，空则为 DEFAULT_USER）。"""
+    uid = _USER_ID_RE.sub("-", _strip_accents(name.strip().casefold())).strip("-")[:64]
+    return uid or DEFAULT_USER
+
+
+def user_shard(user_id: str) -> str:
+    """两位十六进制分片前缀，避免单目录 / 单前缀下对象过多。"""
+    return hashlib.sha1(user_id.encode("utf-8")).hexdigest()[:2]
+
+
+# ---------------------------------------------------------------------------
+# 埋点 — 每个后端 × 操作的延迟直方图、负载字节数、错误数
+# ---------------------------------------------------------------------------
+# 延迟桶上界（毫秒），最后一个桶收纳更慢的调用
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class _OpStats:
+    """单个 (后端, 操作) 的计数器。"""
+
+    __slots__ = ("buckets", "count", "total_ms", "max_ms", "errors", "bytes")
+
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.errors = 0
+        self.bytes = 0
+
+    def observe(self, ms: float) -> None:
+        self.buckets[bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, q: float) -> float:
+        """按桶估算分位数（取所在桶上界，不超过实测最大值）。"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                bound = LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else self.max_ms
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.percentile(0.50),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max_ms, 3),
+            "bytes": self.bytes,
+            "histogram": dict(zip((*LATENCY_BUCKETS_MS, "inf"), self.buckets)),
+        }
+
+
+_op_stats: dict[tuple[str, str], _OpStats] = {}
+_op_stats_lock = threading.Lock()
+_op_context = threading.local()        # 当前线程正在执行的 (后端, 操作) 栈，字节数记到栈顶
+
+
+def _stats_for(backend: str, op: str) -> _OpStats:
+    with _op_stats_lock:
+        stats = _op_stats.get((backend, op))
+        if stats is None:
+            stats = _op_stats[backend, op] = _OpStats()
+        return stats
+
+
+def instrumented(op: str):
+    """装饰后端方法：记录耗时与异常，方法内 _count_bytes() 的字节数记到该操作名下。"""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            stack = _op_context.__dict__.setdefault("stack", [])
+            stack.append((self.name, op))
+            t0 = time.perf_counter()
+            failed = False
+            try:
+                return fn(self, *args, **kwargs)
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                ms = (time.perf_counter() - t0) * 1000
+                stack.pop()
+                stats = _stats_for(self.name, op)
+                with _op_stats_lock:
+                    stats.observe(ms)
+                    stats.errors += failed
+        return wrapper
+    return decorate
+
+
+def _count_bytes(n: int) -> None:
+    """把 n 字节计入当前线程正在执行的存储操作。"""
+    stack = getattr(_op_context, "stack", None)
+    if not stack:
+        return
+    stats = _stats_for(*stack[-1])
+    with _op_stats_lock:
+        stats.bytes += n
+
+
+def storage_metrics() -> dict:
+    """{后端: {操作: 延迟分位数 / 次数 / 错误数 / 字节数 / 直方图}}"""
+    with _op_stats_lock:
+        items = [(k, s.snapshot()) for k, s in _op_stats.items()]
+    out: dict[str, dict] = {}
+    for (backend, op), snap in sorted(items):
+        out.setdefault(backend, {})[op] = snap
+    return out
+
+
+def reset_storage_metrics() -> None:
+    with _op_stats_lock:
+        _op_stats.clear()
+
 
 # ---------------------------------------------------------------------------
 # 抽象基类
 # ---------------------------------------------------------------------------
+class StorageConflictError(RuntimeError):
+    """并发写冲突重试次数用尽。"""
+
+
 class Storage(ABC):
+    """
+    进度存储接口。
+
+    整文档：load_progress / save_progress（所有后端必须实现）。
+    增量：append_score / upsert_weak_point / remove_weak_point / record_exam，
+    以及批量形式 append_events；默认实现为整文档读改写，后端按自身能力覆盖。
+    """
+
+    # 埋点用的后端名
+    name = "base"
+    # append_events 是否为原生增量写入（而非默认的整文档读改写）
+    supports_events = False
+
+    def metrics(self) -> dict:
+        """后端运行指标（计数器快照）。"""
+        return {}
+
     @abstractmethod
-    def load_progress(self) -> dict:
-        """加载进度数据。"""
+    def load_progress(self, user_id: str) -> dict:
+        """加载指定用户的进度数据。"""
 
     @abstractmethod
-    def save_progress(self, data: dict) -> None:
-        """保存进度数据。"""
+    def save_progress(self, user_id: str, data: dict) -> None:
+        """保存指定用户的进度数据。"""
+
+    def sync(self, user_id: str) -> None:
+        """确保该用户已保存的数据落盘；带写缓冲的后端覆盖，其余后端写入即落盘。"""
+
+    # -- 增量写入 --
+    @instrumented("append")
+    def append_events(self, user_id: str, events: list[dict]) -> None:
+        """批量应用进度事件（格式见 lib.progress.apply_events）。"""
+        if events:
+            self.save_progress(user_id, apply_events(self.load_progress(user_id), events))
+
+    def append_score(self, user_id: str, unit: int, pct: int, ts: float | None = None) -> None:
+        """追加一次 quiz 分数。"""
+        self.append_events(user_id, [make_event("quiz_graded", ts, unit=unit, pct=pct)])
+
+    def upsert_weak_point(self, user_id: str, wp_type: str, unit: int, key: str, item: str) -> None:
+        """记一次错题：新建弱点，已存在则 fail_count +1。"""
+        self.append_events(user_id, [make_event(
+            "weak_point_added", type=wp_type, unit=unit, key=key, item=item[:80],
+        )])
+
+    def remove_weak_point(self, user_id: str, wp_type: str, unit: int, key: str) -> None:
+        """记一次做对：fail_count -1，归零则删除该弱点。"""
+        self.append_events(user_id, [make_event(
+            "weak_point_reduced", type=wp_type, unit=unit, key=key,
+        )])
+
+    def record_exam(self, user_id: str, kind: str, ts: float | None = None, **scores) -> None:
+        """追加一次模考记录。"""
+        self.append_events(user_id, [make_event("exam_completed", ts, kind=kind, **scores)])
+
+
+# ---------------------------------------------------------------------------
+# 原子写入
+# ---------------------------------------------------------------------------
+def atomic_write_text(path: Path, text: str) -> None:
+    """atomic_write_bytes 的文本版（UTF-8）。"""
+    atomic_write_bytes(path, text.encode("utf-8"))
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """写临时文件 → fsync → 原子 rename；崩溃时旧文件保持完整。"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    # rename 本身也要落盘
+    try:
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+    except OSError:
+        return  # 部分平台（Windows）不支持打开目录
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
 
 
 # ---------------------------------------------------------------------------
 # FileStorage — 本地 JSON 文件
 # ---------------------------------------------------------------------------
 class FileStorage(Storage):
-    """读写项目根目录下 data/progress.json。"""
+    """
+    读写 data/progress/<分片>/<user_id>.vfp（lib.codec 紧凑编码）。
+
+    旧版 <user_id>.json 照常读取，首次保存后升级并删除。
+    写入为原子替换，并带写后缓冲：save_progress 只把编码结果放进内存，
+    WRITE_BEHIND_SECONDS 窗口内同一用户的多次保存合并为一次落盘；
+    load_progress 优先读缓冲（读己之写），进程退出时 flush。
+    """
+
+    name = "file"
+    WRITE_BEHIND_SECONDS = int(os.environ.get("FILE_WRITE_BEHIND_MS", "500")) / 1000
 
     def __init__(self) -> None:
-        root = Path(__file__).resolve().parent.parent
-        self._path = root / "data" / "progress.json"
+        self._dir = DATA_DIR / "progress"
+        self._legacy_path = DATA_DIR / "progress.json"
+        self._pending: dict[str, bytes] = {}    # {user_id: 已编码的进度}
+        self._lock = threading.Lock()
+        self._timer: threading.Timer | None = None
+        atexit.register(self.flush)
+
+    def _path(self, user_id: str) -> Path:
+        return self._dir / user_shard(user_id) / f"{user_id}.vfp"
 
-    def load_progress(self) -> dict:
-        if not self._path.exists():
+    def _json_path(self, user_id: str) -> Path:
+        return self._dir / user_shard(user_id) / f"{user_id}.json"
+
+    @instrumented("load")
+    def load_progress(self, user_id: str) -> dict:
+        with self._lock:
+            pending = self._pending.get(user_id)
+        if pending is not None:
+            return decode_progress(pending)
+        path = self._path(user_id)
+        if not path.exists():
+            path = self._json_path(user_id)
+        if not path.exists():
+            # 旧版单文件进度归默认用户，首次保存后迁移到分片文件
+            if user_id == DEFAULT_USER and self._legacy_path.exists():
+                path = self._legacy_path
+            else:
+                return {}
+        raw = path.read_bytes()
+        _count_bytes(len(raw))
+        try:
+            return decode_progress(raw)
+        except ProgressDecodeError:
+            # 旧版非原子写入留下的截断文件：改名保留现场，按空进度继续
+            os.replace(path, path.with_suffix(".corrupt"))
             return {}
-        with open(self._path, "r", encoding="utf-8") as f:
-            return json.load(f)
 
-    def save_progress(self, data: dict) -> None:
-        self._path.parent.mkdir(parents=True, exist_ok=True)
-        with open(self._path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    @instrumented("save")
+    def save_progress(self, user_id: str, data: dict) -> None:
+        raw = encode_progress(data)
+        _count_bytes(len(raw))
+        if self.WRITE_BEHIND_SECONDS <= 0:
+            self._write(user_id, raw)
+            return
+        with self._lock:
+            self._pending[user_id] = raw
+            if self._timer is None:
+                self._timer = threading.Timer(self.WRITE_BEHIND_SECONDS, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _write(self, user_id: str, raw: bytes) -> None:
+        atomic_write_bytes(self._path(user_id), raw)
+        self._json_path(user_id).unlink(missing_ok=True)    # 已升级为新格式
+
+    def sync(self, user_id: str) -> None:
+        """立即落盘该用户在写后缓冲中的进度。"""
+        with self._lock:
+            raw = self._pending.pop(user_id, None)
+            if raw is not None:
+                self._write(user_id, raw)
+
+    @instrumented("flush")
+    def flush(self) -> None:
+        """把缓冲中的全部用户进度落盘。"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            # 持锁写入：flush 期间的 load 不会读到落盘前的旧文件
+            while self._pending:
+                user_id, raw = self._pending.popitem()
+                self._write(user_id, raw)
 
 
 # ---------------------------------------------------------------------------
 # S3Storage — AWS S3 JSON 文件
 # ---------------------------------------------------------------------------
 class S3Storage(Storage):
-    """通过 boto3 读写 S3 中的 JSON 文件。"""
+    """
+    通过 boto3 读写 S3，每位用户一个对象（lib.codec 紧凑编码；旧版 .json 对象照常读取）。
+
+    进程内单例（见 get_storage）：共享一个带连接池的 client。
+    读取带 If-None-Match（缓存的 ETag），未变化时 S3 返回 304，直接用内存副本。
+    写入为乐观并发：PUT 带 If-Match（或新建时 If-None-Match: *），
+    412/409 冲突时重新读取、在最新版本上重放本次变更后重试，多副本 / 多标签页不丢分。
+    设置 S3_ENDPOINT_URL 可指向本地 S3 替身（MinIO、moto server 等）。
+    """
+
+    name = "s3"
+    supports_events = True
+    MAX_ATTEMPTS = 5
 
     def __init__(self) -> None:
         import boto3  # noqa: F811 — 延迟导入，仅在 S3 后端时需要
+        from botocore.config import Config
 
         self._bucket = os.environ["S3_BUCKET"]
-        self._key = os.environ.get("S3_KEY", "vibe-francais/progress.json")
-        self._client = boto3.client("s3")
+        self._prefix = os.environ.get("S3_PREFIX", "vibe-francais").rstrip("/")
+        self._legacy_key = os.environ.get("S3_KEY", "vibe-francais/progress.json")
+        self._client = boto3.client(
+            "s3",
+            endpoint_url=os.environ.get("S3_ENDPOINT_URL") or None,
+            config=Config(
+                max_pool_connections=int(os.environ.get("S3_MAX_POOL", "32")),
+                connect_timeout=3,
+                read_timeout=10,
+                retries={"max_attempts": 3, "mode": "standard"},
+                tcp_keepalive=True,
+            ),
+        )
+        self._cache: dict[str, tuple[str, dict]] = {}     # {key: (etag, data)}
+        self._cache_lock = threading.Lock()
+        self._metrics = {"puts": 0, "conflicts": 0, "retries": 0, "exhausted": 0}
+        self._metrics_lock = threading.Lock()
+
+    def _key(self, user_id: str) -> str:
+        return f"{self._prefix}/users/{user_shard(user_id)}/{user_id}.vfp"
+
+    def _json_key(self, user_id: str) -> str:
+        return f"{self._prefix}/users/{user_shard(user_id)}/{user_id}.json"
 
-    def load_progress(self) -> dict:
+    def _count(self, name: str) -> None:
+        with self._metrics_lock:
+            self._metrics[name] += 1
+
+    def metrics(self) -> dict:
+        with self._metrics_lock:
+            return dict(self._metrics)
+
+    # -- 读 --
+    def _fetch(self, key: str) -> tuple[str | None, dict | None]:
+        """条件读取，返回 (etag, data)；对象不存在时为 (None, None)。"""
+        from botocore.exceptions import ClientError
+
+        with self._cache_lock:
+            cached = self._cache.get(key)
+        kwargs = {"Bucket": self._bucket, "Key": key}
+        if cached:
+            kwargs["IfNoneMatch"] = cached[0]
         try:
-            resp = self._client.get_object(Bucket=self._bucket, Key=self._key)
-            return json.loads(resp["Body"].read())
+            resp = self._client.get_object(**kwargs)
         except self._client.exceptions.NoSuchKey:
-            return {}
+            with self._cache_lock:
+                self._cache.pop(key, None)
+            return None, None
+        except ClientError as e:
+            if cached and e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 304:
+                # 深拷贝：缓存副本与 ETag 对应，不能被调用方改到嵌套的弱点 / 历史
+                return cached[0], copy.deepcopy(cached[1])
+            raise
+        raw = resp["Body"].read()
+        _count_bytes(len(raw))
+        data = decode_progress(raw)
+        with self._cache_lock:
+            self._cache[key] = (resp["ETag"], data)
+        return resp["ETag"], copy.deepcopy(data)
+
+    def _load(self, user_id: str) -> tuple[str | None, dict]:
+        etag, data = self._fetch(self._key(user_id))
+        if data is None:
+            # 旧版 JSON 对象（写入时以新建方式落到新 key）
+            _, data = self._fetch(self._json_key(user_id))
+        if data is None and user_id == DEFAULT_USER:
+            # 旧版单对象进度归默认用户
+            _, data = self._fetch(self._legacy_key)
+        return etag, data or {}
+
+    @instrumented("load")
+    def load_progress(self, user_id: str) -> dict:
+        return self._load(user_id)[1]
+
+    # -- 写 --
+    def _put(self, key: str, data: dict, etag: str | None) -> bool:
+        """条件写入；版本已被他人改动时返回 False。"""
+        from botocore.exceptions import ClientError
+
+        cond = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+        body = encode_progress(data)
+        _count_bytes(len(body))
+        try:
+            resp = self._client.put_object(
+                Bucket=self._bucket,
+                Key=key,
+                Body=body,
+                ContentType="application/octet-stream",
+                **cond,
+            )
+        except ClientError as e:
+            if e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") in (409, 412):
+                self._count("conflicts")
+                return False
+            raise
+        self._count("puts")
+        with self._cache_lock:
+            self._cache[key] = (resp["ETag"], copy.deepcopy(data))
+        return True
 
-    def save_progress(self, data: dict) -> None:
-        self._client.put_object(
-            Bucket=self._bucket,
-            Key=self._key,
-            Body=json.dumps(data, ensure_ascii=False, indent=2),
-            ContentType="application/json",
+    def _update(self, user_id: str, build) -> None:
+        """读最新版本 → build(etag, remote) 生成新文档 → 条件写入；冲突则退避重试。"""
+        key = self._key(user_id)
+        for attempt in range(self.MAX_ATTEMPTS):
+            if attempt:
+                self._count("retries")
+                time.sleep(0.05 * 2 ** attempt * (0.5 + random.random()))
+            etag, remote = self._load(user_id)
+            if self._put(key, build(etag, remote), etag):
+                return
+        self._count("exhausted")
+        raise StorageConflictError(f"S3 写入冲突，重试 {self.MAX_ATTEMPTS} 次仍失败：{key}")
+
+    @instrumented("save")
+    def save_progress(self, user_id: str, data: dict) -> None:
+        """
+        整文档写入：期间无他人写入则直接覆盖，否则与最新版本合并。
+
+        合并以缓存中读到的版本为 base 做三方合并，本地删掉的弱点不会被远端版本带回。
+        """
+        with self._cache_lock:
+            cached = self._cache.get(self._key(user_id))
+        base_etag, base = cached if cached else (None, None)
+        self._update(
+            user_id,
+            lambda etag, remote: data if etag == base_etag else merge_progress(data, remote, base),
         )
 
+    @instrumented("append")
+    def append_events(self, user_id: str, events: list[dict]) -> None:
+        """在最新版本上重放本次事件（冲突重试时重放到新的最新版本上）。"""
+        if events:
+            self._update(user_id, lambda _etag, remote: apply_events(remote, events))
+
+
+# ---------------------------------------------------------------------------
+# EventLogStorage — 追加式 JSONL 事件日志 + 周期性压实快照
+# ---------------------------------------------------------------------------
+class EventLogStorage(Storage):
+    """
+    每位用户一个目录 data/events/<分片>/<user_id>/：
+
+    - log-<seq>.jsonl   追加写入的事件段（每次保存 O(1) 追加）
+    - snapshot.json     {"seq": n, "data": {...}}，已折叠 seq <= n 的全部段
+    - archive/          折叠后的旧段，保留完整作答原始记录
+
+    加载 = 快照 + 重放 seq > n 的段。当前段超过 COMPACT_BYTES 时切换到新段，
+    后台线程把旧段折叠进快照；快照先原子写入再归档旧段，任意时刻崩溃都不会重复重放。
+    """
+
+    name = "eventlog"
+    supports_events = True
+    COMPACT_BYTES = 64 * 1024
+
+    def __init__(self) -> None:
+        self._dir = DATA_DIR / "events"
+        self._locks: dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    # -- 路径 / 锁 --
+    def _user_dir(self, user_id: str) -> Path:
+        return self._dir / user_shard(user_id) / user_id
+
+    def _lock(self, user_id: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(user_id, threading.Lock())
+
+    @staticmethod
+    def _segments(user_dir: Path) -> list[tuple[int, Path]]:
+        segs = []
+        for p in user_dir.glob("log-*.jsonl"):
+            segs.append((int(p.stem.split("-", 1)[1]), p))
+        return sorted(segs)
+
+    def _read_snapshot(self, user_dir: Path) -> tuple[int, dict]:
+        path = user_dir / "snapshot.json"
+        if not path.exists():
+            return 0, {}
+        raw = path.read_bytes()
+        _count_bytes(len(raw))
+        snap = json.loads(raw)
+        return snap.get("seq", 0), snap.get("data", {})
+
+    @staticmethod
+    def _read_events(path: Path) -> list[dict]:
+        events = []
+        _count_bytes(path.stat().st_size)
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # 崩溃时最后一行可能写了一半，跳过
+                    continue
+        return events
+
+    def _fold(self, user_dir: Path, upto: int | None = None) -> tuple[int, dict]:
+        """快照 + 重放快照之后的段（可限定到 upto 为止）。"""
+        seq, data = self._read_snapshot(user_dir)
+        for s, path in self._segments(user_dir):
+            if s <= seq or (upto is not None and s > upto):
+                continue
+            data = apply_events(data, self._read_events(path))
+            seq = s
+        return seq, data
+
+    # -- Storage 接口 --
+    def _ensure_user_dir(self, user_id: str) -> Path:
+        """首次写入时建目录；已有本地文件进度则作为初始快照导入。"""
+        user_dir = self._user_dir(user_id)
+        if not user_dir.exists():
+            seed = _file_storage.load_progress(user_id)
+            user_dir.mkdir(parents=True, exist_ok=True)
+            if seed:
+                self._write_snapshot(user_dir, 0, seed)
+        return user_dir
+
+    @instrumented("load")
+    def load_progress(self, user_id: str) -> dict:
+        user_dir = self._user_dir(user_id)
+        if not user_dir.exists():
+            return _file_storage.load_progress(user_id)
+        # 持锁读：后台压实会写新快照并把旧段移入 archive/，读到一半时会漏事件或找不到段文件
+        with self._lock(user_id):
+            return self._fold(user_dir)[1]
+
+    @instrumented("save")
+    def save_progress(self, user_id: str, data: dict) -> None:
+        """整文档写入：直接作为新快照，并归档已有事件段。"""
+        with self._lock(user_id):
+            user_dir = self._ensure_user_dir(user_id)
+            segs = self._segments(user_dir)
+            seq = segs[-1][0] if segs else self._read_snapshot(user_dir)[0]
+            self._write_snapshot(user_dir, seq, data)
+            self._archive(user_dir, seq)
+
+    @instrumented("append")
+    def append_events(self, user_id: str, events: list[dict]) -> None:
+        """追加事件到当前段；段过大时触发后台压实。"""
+        if not events:
+            return
+        payload = "".join(json.dumps(ev, ensure_ascii=False) + "\n" for ev in events)
+        _count_bytes(len(payload.encode("utf-8")))
+        with self._lock(user_id):
+            user_dir = self._ensure_user_dir(user_id)
+            segs = self._segments(user_dir)
+            if segs:
+                seq, path = segs[-1]
+            else:
+                seq = self._read_snapshot(user_dir)[0] + 1
+                path = user_dir / f"log-{seq}.jsonl"
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(payload)
+            if path.stat().st_size < self.COMPACT_BYTES:
+                return
+            # 切换到新段，旧段交给后台线程折叠
+            (user_dir / f"log-{seq + 1}.jsonl").touch()
+        threading.Thread(
+            target=self.compact, args=(user_id, seq), daemon=True,
+        ).start()
+
+    # -- 压实 --
+    @instrumented("compact")
+    def compact(self, user_id: str, upto: int | None = None) -> None:
+        """把 seq <= upto 的段折叠进快照（默认折叠到最后一个已关闭的段）。"""
+        user_dir = self._user_dir(user_id)
+        with self._lock(user_id):
+            segs = self._segments(user_dir)
+            if upto is None:
+                if len(segs) < 2:
+                    return
+                upto = segs[-2][0]
+            seq, data = self._fold(user_dir, upto)
+            self._write_snapshot(user_dir, seq, data)
+            self._archive(user_dir, seq)
+
+    @staticmethod
+    def _write_snapshot(user_dir: Path, seq: int, data: dict) -> None:
+        text = json.dumps({"seq": seq, "data": data}, ensure_ascii=False)
+        _count_bytes(len(text.encode("utf-8")))
+        atomic_write_text(user_dir / "snapshot.json", text)
+
+    def _archive(self, user_dir: Path, seq: int) -> None:
+        """把已折叠的段移入 archive/（保留原始事件）。"""
+        archive = user_dir / "archive"
+        for s, path in self._segments(user_dir):
+            if s <= seq:
+                archive.mkdir(exist_ok=True)
+                os.replace(path, archive / f"{int(time.time())}-{path.name}")
+
+
+# ---------------------------------------------------------------------------
+# SQLiteStorage — WAL 模式，规范化表，小事务 upsert
+# ---------------------------------------------------------------------------
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS progress_meta (
+    user_id  TEXT PRIMARY KEY,
+    rollups  TEXT                          -- 整文档写入时保留的日/周汇总 JSON
+);
+CREATE TABLE IF NOT EXISTS attempts (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id  TEXT    NOT NULL,
+    unit     INTEGER NOT NULL,
+    pct      INTEGER NOT NULL,
+    ts       REAL    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attempts_user_ts   ON attempts (user_id, ts);
+CREATE INDEX IF NOT EXISTS attempts_user_unit ON attempts (user_id, unit);
+CREATE TABLE IF NOT EXISTS unit_scores (
+    user_id  TEXT    NOT NULL,
+    unit     INTEGER NOT NULL,
+    count    INTEGER NOT NULL,
+    sum      INTEGER NOT NULL,
+    best     INTEGER NOT NULL,
+    PRIMARY KEY (user_id, unit)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS weak_points (
+    user_id    TEXT    NOT NULL,
+    type       TEXT    NOT NULL,
+    unit       INTEGER NOT NULL,
+    key        TEXT    NOT NULL,
+    item       TEXT    NOT NULL,
+    fail_count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, type, unit, key)
+);
+CREATE INDEX IF NOT EXISTS weak_points_user_unit ON weak_points (user_id, unit);
+CREATE TABLE IF NOT EXISTS exams (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id  TEXT NOT NULL,
+    ts       REAL NOT NULL,
+    payload  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS exams_user_ts ON exams (user_id, ts);
+CREATE TABLE IF NOT EXISTS applied_events (   -- 最近已应用的事件 id，重试写入时去重
+    user_id  TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    PRIMARY KEY (user_id, event_id)
+);
+"""
+
+# 热路径 SQL 固定为模块常量：sqlite3 按 SQL 文本缓存预编译语句（每连接 cached_statements 条）
+_SQL_TOUCH_USER = "INSERT OR IGNORE INTO progress_meta (user_id) VALUES (?)"
+_SQL_USER_EXISTS = "SELECT rollups FROM progress_meta WHERE user_id = ?"
+_SQL_INSERT_ATTEMPT = "INSERT INTO attempts (user_id, unit, pct, ts) VALUES (?, ?, ?, ?)"
+_SQL_UPSERT_UNIT = """
+INSERT INTO unit_scores (user_id, unit, count, sum, best) VALUES (?, ?, 1, ?, ?)
+ON CONFLICT (user_id, unit) DO UPDATE SET
+    count = count + 1, sum = sum + excluded.sum, best = max(best, excluded.best)
+"""
+_SQL_ADD_WEAK = """
+INSERT INTO weak_points (user_id, type, unit, key, item, fail_count) VALUES (?, ?, ?, ?, ?, 1)
+ON CONFLICT (user_id, type, unit, key) DO UPDATE SET fail_count = fail_count + 1
+"""
+_SQL_REDUCE_WEAK = """
+UPDATE weak_points SET fail_count = fail_count - 1
+WHERE user_id = ? AND type = ? AND unit = ? AND key = ?
+"""
+_SQL_PRUNE_WEAK = """
+DELETE FROM weak_points
+WHERE user_id = ? AND type = ? AND unit = ? AND key = ? AND fail_count <= 0
+"""
+_SQL_INSERT_EXAM = "INSERT INTO exams (user_id, ts, payload) VALUES (?, ?, ?)"
+_SQL_MARK_APPLIED = "INSERT OR IGNORE INTO applied_events (user_id, event_id) VALUES (?, ?)"
+_SQL_PRUNE_APPLIED = """
+DELETE FROM applied_events WHERE user_id = ? AND rowid NOT IN (
+    SELECT rowid FROM applied_events WHERE user_id = ? ORDER BY rowid DESC LIMIT ?
+)
+"""
+_SQL_APPLIED = "SELECT event_id FROM applied_events WHERE user_id = ? ORDER BY rowid"
+_SQL_RECENT_ATTEMPTS = """
+SELECT ts, unit, pct FROM attempts WHERE user_id = ?
+ORDER BY ts DESC, id DESC LIMIT ?
+"""
+_SQL_OLDER_ROLLUPS = """
+SELECT CAST(ts / 86400 AS INTEGER) AS day, COUNT(*), SUM(pct), MAX(pct)
+FROM (SELECT ts, pct FROM attempts WHERE user_id = ?
+      ORDER BY ts DESC, id DESC LIMIT -1 OFFSET ?)
+GROUP BY day ORDER BY day
+"""
+_SQL_UNIT_SCORES = "SELECT unit, count, sum, best FROM unit_scores WHERE user_id = ?"
+_SQL_WEAK_POINTS = """
+SELECT type, unit, key, item, fail_count FROM weak_points WHERE user_id = ? ORDER BY rowid
+"""
+_SQL_EXAMS = "SELECT payload FROM exams WHERE user_id = ? ORDER BY ts DESC, id DESC LIMIT ?"
+
+
+class SQLiteStorage(Storage):
+    """
+    单个 SQLite 数据库（默认 data/progress.db，可用 SQLITE_PATH 覆盖）。
+
+    - WAL 模式：读写互不阻塞，多个 Streamlit 脚本线程可并发读
+    - 进程内共享一个小连接池（最多 POOL_SIZE 个）：Streamlit 每次脚本运行换一个线程，
+      按线程建连接会反复建连、重跑建表且从不关闭；池内连接跨线程复用，预编译语句缓存才有效
+    - 每次保存只在一个事务里追加 / upsert 本次变更的几行
+    - 加载时由 attempts 表重建有界 history（最近明细 + SQL 聚合出的日汇总）
+    """
+
+    name = "sqlite"
+    supports_events = True
+
+    POOL_SIZE = int(os.environ.get("SQLITE_POOL", "4"))
+
+    def __init__(self) -> None:
+        self._path = Path(os.environ.get("SQLITE_PATH", DATA_DIR / "progress.db"))
+        self._pool: queue.LifoQueue = queue.LifoQueue()
+        self._opened = 0
+        self._open_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _open(self):
+        """新建一个池内连接；建表与 WAL（持久于数据库文件）只在进程内第一次打开时执行。"""
+        import sqlite3
+
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            self._path, timeout=5, isolation_level=None, cached_statements=256,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA synchronous=NORMAL")      # 连接级设置，每个连接都要设
+        if not self._schema_ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SQLITE_SCHEMA)
+            self._schema_ready = True
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        """从池中借一个连接（用完归还）；池满时等待其他线程归还。"""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._open_lock:
+                if self._opened < self.POOL_SIZE:
+                    conn = self._open()
+                    self._opened += 1
+            if conn is None:
+                conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    # -- 读 --
+    @instrumented("load")
+    def load_progress(self, user_id: str) -> dict:
+        from lib.history import RING_SIZE, ScoreHistory
+        from lib.progress import EXAMS_KEPT, ProgressStats
+
+        with self._connection() as conn:
+            meta = conn.execute(_SQL_USER_EXISTS, (user_id,)).fetchone()
+            if meta is None:
+                # 尚未写入过 SQLite：沿用本地文件中的进度（首次写入时导入）
+                return _file_storage.load_progress(user_id)
+
+            history = ScoreHistory()
+            if meta[0]:
+                rollups = json.loads(meta[0])
+                history = ScoreHistory.from_dict({"daily": rollups["daily"], "weekly": rollups["weekly"]})
+            for day, count, total, best in conn.execute(_SQL_OLDER_ROLLUPS, (user_id, RING_SIZE)):
+                history.add_rollup(day, count, total, best)
+            recent = conn.execute(_SQL_RECENT_ATTEMPTS, (user_id, RING_SIZE)).fetchall()
+            for ts, unit, pct in reversed(recent):
+                history.record(unit, pct, ts)
+
+            stats = ProgressStats()
+            for unit, count, total, best in conn.execute(_SQL_UNIT_SCORES, (user_id,)):
+                stats.units[unit] = {"count": count, "sum": total, "best": best}
+                stats.count += count
+                stats.total += total
+            stats.recent.extend(pct for _ts, _unit, pct in reversed(recent[:stats.WINDOW]))
+
+            weak_points = [
+                {"type": t, "unit": u, "key": k, "item": item, "fail_count": fc}
+                for t, u, k, item, fc in conn.execute(_SQL_WEAK_POINTS, (user_id,))
+            ]
+            exams = [
+                json.loads(payload)
+                for (payload,) in conn.execute(_SQL_EXAMS, (user_id, EXAMS_KEPT))
+            ]
+            exams.reverse()
+            return {
+                "history": history.to_dict(),
+                "stats": stats.to_dict(),
+                "weak_points": weak_points,
+                "exams": exams,
+                "applied": [i for (i,) in conn.execute(_SQL_APPLIED, (user_id,))],
+            }
+
+    # -- 写 --
+    def _seed_if_new(self, conn, user_id: str) -> None:
+        """用户首次写入：有本地文件进度则先整体导入。"""
+        if conn.execute(_SQL_USER_EXISTS, (user_id,)).fetchone() is None:
+            seed = _file_storage.load_progress(user_id)
+            if seed:
+                # 空重放即旧版 scores → history / stats 的迁移，与其他后端一致
+                self._replace(conn, user_id, apply_events(seed, []))
+        conn.execute(_SQL_TOUCH_USER, (user_id,))
+
+    @instrumented("append")
+    def append_events(self, user_id: str, events: list[dict]) -> None:
+        if not events:
+            return
+        with self._connection() as conn:
+            with _sqlite_tx(conn):
+                self._seed_if_new(conn, user_id)
+                for ev in events:
+                    if ev.get("id") is not None:
+                        if conn.execute(_SQL_MARK_APPLIED, (user_id, ev["id"])).rowcount == 0:
+                            continue        # 重试写入：该事件已应用过
+                    kind = ev.get("event")
+                    if kind == "quiz_graded":
+                        conn.execute(_SQL_INSERT_ATTEMPT, (user_id, ev["unit"], ev["pct"], ev["ts"]))
+                        conn.execute(_SQL_UPSERT_UNIT, (user_id, ev["unit"], ev["pct"], ev["pct"]))
+                    elif kind == "weak_point_added":
+                        conn.execute(_SQL_ADD_WEAK, (
+                            user_id, ev["type"], ev["unit"], ev["key"], ev.get("item", "")[:80],
+                        ))
+                    elif kind == "weak_point_reduced":
+                        args = (user_id, ev["type"], ev["unit"], ev["key"])
+                        conn.execute(_SQL_REDUCE_WEAK, args)
+                        conn.execute(_SQL_PRUNE_WEAK, args)
+                    elif kind == "exam_completed":
+                        conn.execute(_SQL_INSERT_EXAM, (
+                            user_id, ev["ts"], json.dumps(exam_record(ev), ensure_ascii=False),
+                        ))
+                conn.execute(_SQL_PRUNE_APPLIED, (user_id, user_id, APPLIED_KEPT))
+
+    @instrumented("save")
+    def save_progress(self, user_id: str, data: dict) -> None:
+        """整文档写入（回退路径）：在一个事务里替换该用户的全部行。"""
+        with self._connection() as conn:
+            with _sqlite_tx(conn):
+                self._replace(conn, user_id, data)
+
+    @staticmethod
+    def _replace(conn, user_id: str, data: dict) -> None:
+        for table in ("attempts", "unit_scores", "weak_points", "exams", "applied_events"):
+            conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+        history = data.get("history") or {}
+        ring = history.get("ring", {})
+        conn.executemany(_SQL_INSERT_ATTEMPT, [
+            (user_id, u, p, t)
+            for t, u, p in zip(ring.get("ts", []), ring.get("unit", []), ring.get("pct", []))
+        ])
+        rollups = json.dumps({
+            "daily": history.get("daily", {}), "weekly": history.get("weekly", {}),
+        })
+        conn.execute(
+            "INSERT INTO progress_meta (user_id, rollups) VALUES (?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET rollups = excluded.rollups",
+            (user_id, rollups),
+        )
+        units = ((data.get("stats") or {}).get("units") or {}).items()
+        conn.executemany(
+            "INSERT INTO unit_scores (user_id, unit, count, sum, best) VALUES (?, ?, ?, ?, ?)",
+            [(user_id, int(n), u["count"], u["sum"], u["best"]) for n, u in units],
+        )
+        conn.executemany(
+            "INSERT INTO weak_points (user_id, type, unit, key, item, fail_count) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (user_id, wp.get("type", ""), wp.get("unit", 0), wp.get("key", ""),
+                 wp.get("item", ""), wp.get("fail_count", 1))
+                for wp in data.get("weak_points", [])
+            ],
+        )
+        conn.executemany(_SQL_INSERT_EXAM, [
+            (user_id, e.get("ts") or 0, json.dumps(e, ensure_ascii=False))
+            for e in data.get("exams", [])
+        ])
+        conn.executemany(_SQL_MARK_APPLIED, [
+            (user_id, event_id) for event_id in data.get("applied", [])[-APPLIED_KEPT:]
+        ])
+
+
+@contextmanager
+def _sqlite_tx(conn):
+    """autocommit 连接上的显式事务（BEGIN IMMEDIATE 尽早拿写锁，避免升级死锁）。"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+# 文件后端持有写后缓冲、事件日志后端持有每用户锁、SQLite 后端持有连接池，进程内各共享同一实例
+_file_storage = FileStorage()
+_event_log_storage = EventLogStorage()
+_sqlite_storage = SQLiteStorage()
+
 
 # ---------------------------------------------------------------------------
 # 工厂函数
 # ---------------------------------------------------------------------------
+_s3_storage: S3Storage | None = None
+_s3_lock = threading.Lock()
+
+
+def _get_s3_storage() -> Storage:
+    """S3 后端单例：client 构建一次、连接池与 ETag 缓存进程内共享。"""
+    global _s3_storage
+    if _s3_storage is None:
+        with _s3_lock:
+            if _s3_storage is None:
+                _s3_storage = S3Storage()
+    return _s3_storage
+
+
 def get_storage() -> Storage:
     """根据 STORAGE_BACKEND 环境变量选择后端（默认 FileStorage）。"""
-    if os.environ.get("STORAGE_BACKEND") == "s3":
+    backend = os.environ.get("STORAGE_BACKEND")
+    if backend == "eventlog":
+        return _event_log_storage
+    if backend == "sqlite":
+        return _sqlite_storage
+    if backend == "s3":
         try:
-            return S3Storage()
+            return _get_s3_storage()
         except (ImportError, KeyError):
             # boto3 未安装或 S3_BUCKET 未配置，回退到本地文件
-            return FileStorage()
-    return FileStorage()
+            return _file_storage
+    return _file_storage
 
 
 # ---------------------------------------------------------------------------
 # 便捷函数 — 页面代码直接调用
 # ---------------------------------------------------------------------------
-def save_scores(scores: dict, weak_points: list) -> None:
-    """保存分数和弱点到持久化存储。"""
+def save_changes(user_id: str, events: list[dict], sync: bool = False) -> None:
+    """把本会话的增量变更（进度事件）写入当前后端；sync=True 时返回前确保已落盘。"""
     storage = get_storage()
-    data = storage.load_progress()
-    data["scores"] = scores
-    data["weak_points"] = weak_points
-    storage.save_progress(data)
+    storage.append_events(user_id, events)
+    if sync:
+        storage.sync(user_id)
 
 
-def load_saved_progress() -> dict:
-    """加载已保存的进度，保证返回结构完整。"""
-    data = get_storage().load_progress()
+def load_saved_progress(user_id: str) -> dict:
+    """加载指定用户已保存的进度，保证返回结构完整。"""
+    data = get_storage().load_progress(user_id)
     return {
-        "scores": data.get("scores", {}),
+        "history": data.get("history"),
+        "scores": data.get("scores", {}),     # 旧版格式，仅用于迁移
         "weak_points": data.get("weak_points", []),
+        "stats": data.get("stats"),
+        "exams": data.get("exams", []),
     }
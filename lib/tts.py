@@ -11,26 +11,42 @@ from pathlib import Path
 import streamlit as st
 
 
+VOICE = "fr-FR-DeniseNeural"
+RATE = "-10%"
+
+
+async def synthesize_french_async(text: str) -> bytes:
+    """异步合成 MP3，失败直接抛异常；可与其他协程并发。"""
+    import edge_tts
+
+    communicate = edge_tts.Communicate(text, voice=VOICE, rate=RATE)
+    with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as tmp:
+        path = Path(tmp.name)
+    try:
+        await communicate.save(str(path))
+        return path.read_bytes()
+    finally:
+        path.unlink(missing_ok=True)
+
+
+def synthesize_french(text: str) -> bytes:
+    """在独立事件循环里合成 MP3，失败直接抛异常；供后台线程调用。"""
+    import asyncio
+
+    return asyncio.run(synthesize_french_async(text))
+
+
 def tts_french(text: str) -> bytes | None:
     """将法语文本转为 MP3 音频。"""
     try:
         import asyncio
 
-        import edge_tts
         import nest_asyncio
 
         nest_asyncio.apply()
 
-        async def _generate() -> bytes:
-            communicate = edge_tts.Communicate(
-                text, voice="fr-FR-DeniseNeural", rate="-10%"
-            )
-            with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as tmp:
-                await communicate.save(tmp.name)
-                return Path(tmp.name).read_bytes()
-
         loop = asyncio.get_event_loop()
-        return loop.run_until_complete(_generate())
+        return loop.run_until_complete(synthesize_french_async(text))
     except Exception as e:
         st.error(f"TTS 生成失败: {e}")
         return None
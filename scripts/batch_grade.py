@@ -0,0 +1,339 @@
+"""
+批量评分 — 离线重评一批作文，复用 lib/grading.py 的评分 prompt 与结构化分数校验。
+
+用法：
+    python scripts/batch_grade.py essays/ --kind writing --unit 3 --out results.jsonl
+    python scripts/batch_grade.py submissions.jsonl --kind exam_writing --concurrency 16 --rpm 120
+    python scripts/batch_grade.py essays/ --unit 3 --stub-server --rpm 600      # 本地替身，不调用真实 API
+
+输入：
+- 目录：每个 .txt / .md 文件一篇作文，id 为相对路径；评分对象由 --unit / --prompt 给出
+- .jsonl：每行 {"id", "text", 可选 "kind" / "unit" / "prompt"}，逐行覆盖命令行默认值
+  （应用只保存分数不保存原文，需要重评的提交先导出成这种格式）
+
+- 有界并发：--concurrency 个 worker 协程共享一个令牌桶（--rpm 每分钟请求数，--burst 突发量）
+- 可续跑：完成的 id 追加写入检查点文件（默认 <out>.ckpt），重跑时跳过；失败的条目不入检查点
+- 输出：每篇一行 JSONL，{"id", "kind", "ok", "criteria", "total", "max", "feedback", "latency_s", ...}
+- API：--base-url 指向任意 OpenAI 兼容服务（默认 OpenRouter，Key 取 OPENROUTER_API_KEY /
+  OPENAI_API_KEY）；--stub-server 启动进程内替身服务，按 schema 返回合法的随机分数
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+KINDS = ("writing", "exam_writing", "oral")
+PROGRESS_EVERY = 5.0        # 进度行输出间隔（秒）
+
+
+# ---------------------------------------------------------------------------
+# 限速
+# ---------------------------------------------------------------------------
+class TokenBucket:
+    """令牌桶：平均 rate 个/秒，最多积攒 burst 个；acquire 在令牌不足时异步等待。"""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:          # 排队取令牌，先到先得
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# ---------------------------------------------------------------------------
+# 输入 / 检查点
+# ---------------------------------------------------------------------------
+def _load_items(path: Path, defaults: dict) -> list[dict]:
+    if path.is_dir():
+        files = sorted(p for p in path.rglob("*") if p.suffix in (".txt", ".md") and p.is_file())
+        return [
+            {**defaults, "id": str(p.relative_to(path)), "text": p.read_text(encoding="utf-8")}
+            for p in files
+        ]
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                row = None
+            if not isinstance(row, dict):
+                # 坏行照常占一个结果，评分时记为错误，不影响其余行
+                items.append({**defaults, "id": str(n), "invalid": f"第 {n} 行不是 JSON 对象"})
+                continue
+            items.append({**defaults, "id": str(row.get("id", n)), **row})
+    return items
+
+
+def _load_checkpoint(path: Path) -> set[str]:
+    try:
+        return set(path.read_text(encoding="utf-8").splitlines())
+    except OSError:
+        return set()
+
+
+def _subject(item: dict, units: dict[int, dict]):
+    """评分对象：writing / oral 为单元 dict，exam_writing 为题目文本；输入不合格时抛 ValueError。"""
+    from lib.prompts import EXAM_WRITING_PROMPTS
+
+    if item.get("invalid"):
+        raise ValueError(item["invalid"])
+    if item.get("kind") not in KINDS:
+        raise ValueError(f"未知评分类型：{item.get('kind')!r}")
+    if not isinstance(item.get("text"), str) or not item["text"].strip():
+        raise ValueError("缺少 text")
+    if item["kind"] == "exam_writing":
+        if item.get("prompt"):
+            return item["prompt"]
+        if item.get("unit") in EXAM_WRITING_PROMPTS:
+            return EXAM_WRITING_PROMPTS[item["unit"]]
+        raise ValueError("exam_writing 需要 prompt 或 unit")
+    unit = units.get(item.get("unit"))
+    if unit is None:
+        raise ValueError(f"未知单元：{item.get('unit')!r}")
+    return unit
+
+
+# ---------------------------------------------------------------------------
+# 本地替身服务
+# ---------------------------------------------------------------------------
+class _StubHandler(BaseHTTPRequestHandler):
+    """最小的 /chat/completions 实现：按 response_format 中的 schema 随机给出合法分数。"""
+
+    latency = 0.0
+
+    def do_POST(self) -> None:
+        from lib.grading import RUBRICS
+
+        body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))))
+        time.sleep(self.latency)
+        name = body.get("response_format", {}).get("json_schema", {}).get("name", "")
+        rubric = RUBRICS.get(name.removeprefix("rubric_"), RUBRICS["writing"])
+        criteria = [random.randint(top // 2, top) for _name, top in rubric]
+        content = json.dumps({
+            "criteria": criteria, "total": sum(criteria), "feedback": "## Commentaire\nStub.",
+        })
+        payload = json.dumps({
+            "id": "stub", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0, "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }],
+            "usage": {"prompt_tokens": 600, "completion_tokens": 300, "total_tokens": 900},
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def _start_stub_server(latency: float) -> str:
+    _StubHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    threading.Thread(target=server.serve_forever, name="stub-llm", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/v1"
+
+
+# ---------------------------------------------------------------------------
+# 评分
+# ---------------------------------------------------------------------------
+async def _grade_one(
+    client, args, item: dict, units: dict[int, dict], bucket: TokenBucket, usage: dict,
+) -> dict:
+    from lib.grading import backoff_delay, grading_request, is_retryable, parse_grade
+
+    result = {"id": item["id"], "kind": item.get("kind"), "ok": False}
+    started = time.monotonic()
+    try:
+        subject = _subject(item, units)
+        system, response_format = grading_request(item["kind"], item["text"], subject)
+    except ValueError as e:
+        return {**result, "error": str(e), "latency_s": 0.0}
+    extra = {} if args.no_schema else {"response_format": response_format}
+    for attempt in range(1, args.max_attempts + 1):
+        await bucket.acquire()
+        try:
+            resp = await client.chat.completions.create(
+                model=args.model,
+                temperature=args.temperature,
+                messages=[
+                    {"role": "system", "content": system},
+                    {"role": "user", "content": item["text"]},
+                ],
+                **extra,
+            )
+        except Exception as e:
+            if attempt < args.max_attempts and is_retryable(e):
+                await asyncio.sleep(backoff_delay(e, attempt))
+                continue
+            return {**result, "error": str(e), "attempts": attempt,
+                    "latency_s": round(time.monotonic() - started, 3)}
+        if resp.usage:
+            usage["prompt"] += resp.usage.prompt_tokens or 0
+            usage["completion"] += resp.usage.completion_tokens or 0
+        record = parse_grade(item["kind"], resp.choices[0].message.content)
+        if record is not None:
+            return {**result, "ok": True, **record, "model": resp.model, "attempts": attempt,
+                    "latency_s": round(time.monotonic() - started, 3)}
+        result["error"] = "invalid rubric"         # 格式不合格：重新请求
+    return {**result, "attempts": args.max_attempts, "latency_s": round(time.monotonic() - started, 3)}
+
+
+async def _run(args, items: list[dict], units: dict[int, dict]) -> tuple[list[dict], dict]:
+    from openai import AsyncOpenAI
+
+    client = AsyncOpenAI(
+        api_key=args.api_key, base_url=args.base_url, max_retries=0,
+        timeout=args.timeout,
+    )
+    bucket = TokenBucket(args.rpm / 60, args.burst)
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in items:
+        queue.put_nowait(item)
+    usage = {"prompt": 0, "completion": 0}
+    results: list[dict] = []
+    started = time.monotonic()
+
+    with open(args.out, "a", encoding="utf-8") as out, open(args.checkpoint, "a", encoding="utf-8") as ckpt:
+        async def worker() -> None:
+            while True:
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                result = await _grade_one(client, args, item, units, bucket, usage)
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                if result["ok"]:
+                    # 结果先落盘再记检查点：中断时最多重评一篇，不会漏评
+                    ckpt.write(item["id"] + "\n")
+                    ckpt.flush()
+                results.append(result)
+
+        async def report() -> None:
+            while True:
+                await asyncio.sleep(PROGRESS_EVERY)
+                elapsed = time.monotonic() - started
+                print(f"  {len(results)}/{len(items)} done · {len(results) / elapsed:.2f} items/s",
+                      file=sys.stderr)
+
+        reporter = asyncio.create_task(report())
+        await asyncio.gather(*(worker() for _ in range(min(args.concurrency, len(items)))))
+        reporter.cancel()
+    await client.close()
+    return results, usage
+
+
+# ---------------------------------------------------------------------------
+# 报告
+# ---------------------------------------------------------------------------
+def _print_report(results: list[dict], skipped: int, elapsed: float, usage: dict) -> None:
+    ok = [r for r in results if r["ok"]]
+    latencies = sorted(r["latency_s"] for r in results)
+
+    def pct(q: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q))] if latencies else 0.0
+
+    tokens = usage["prompt"] + usage["completion"]
+    print(f"\ngraded {len(results)} (ok {len(ok)}, failed {len(results) - len(ok)}, "
+          f"skipped {skipped} from checkpoint) in {elapsed:.1f}s")
+    print(f"  throughput: {len(results) / elapsed if elapsed else 0:.2f} items/s · "
+          f"{tokens / elapsed if elapsed else 0:.0f} tokens/s "
+          f"({usage['prompt']} prompt + {usage['completion']} completion)")
+    print(f"  latency: p50 {pct(0.5):.2f}s · p95 {pct(0.95):.2f}s · max {pct(1.0):.2f}s")
+    if ok:
+        print(f"  mean score: {sum(r['total'] / r['max'] for r in ok) / len(ok) * 100:.1f}%")
+    errors: dict[str, int] = {}
+    for r in results:
+        if not r["ok"]:
+            msg = r.get("error", "?")[:80]
+            errors[msg] = errors.get(msg, 0) + 1
+    for msg, n in sorted(errors.items(), key=lambda kv: -kv[1]):
+        print(f"  error ×{n}: {msg}")
+
+
+# ---------------------------------------------------------------------------
+# 主流程
+# ---------------------------------------------------------------------------
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", type=Path, help="作文目录，或 .jsonl 提交文件")
+    parser.add_argument("--kind", choices=KINDS, default="writing")
+    parser.add_argument("--unit", type=int, help="writing / oral 的单元号（exam_writing 时取该单元的模考题目）")
+    parser.add_argument("--prompt", help="exam_writing 的题目文本")
+    parser.add_argument("--out", type=Path, default=Path("grades.jsonl"))
+    parser.add_argument("--checkpoint", type=Path, help="默认 <out>.ckpt")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rpm", type=float, default=60, help="每分钟最多请求数")
+    parser.add_argument("--burst", type=int, default=5)
+    parser.add_argument("--max-attempts", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--model", default=None, help="默认同应用（DEFAULT_MODEL）")
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--base-url", default=None, help="OpenAI 兼容服务地址，默认 OpenRouter")
+    parser.add_argument("--no-schema", action="store_true",
+                        help="不发送 response_format（本地服务不支持 json_schema 时使用）")
+    parser.add_argument("--stub-server", action="store_true", help="启动进程内替身服务")
+    parser.add_argument("--stub-latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    from lib.grading import DEFAULT_MODEL, OPENROUTER_BASE_URL
+
+    args.model = args.model or DEFAULT_MODEL
+    args.checkpoint = args.checkpoint or args.out.with_name(args.out.name + ".ckpt")
+    if args.stub_server:
+        args.base_url = _start_stub_server(args.stub_latency)
+        args.api_key = "stub"
+    else:
+        args.base_url = args.base_url or OPENROUTER_BASE_URL
+        args.api_key = os.environ.get("OPENROUTER_API_KEY") or os.environ.get("OPENAI_API_KEY", "local")
+
+    with open(ROOT / "data.json", encoding="utf-8") as f:
+        units = {u["unit_number"]: u for u in json.load(f)}
+    items = _load_items(args.input, {"kind": args.kind, "unit": args.unit, "prompt": args.prompt})
+    done = _load_checkpoint(args.checkpoint)
+    todo = [item for item in items if item["id"] not in done]
+    print(f"{len(items)} items, {len(items) - len(todo)} already graded · "
+          f"{args.base_url} · {args.model} · concurrency {args.concurrency} · {args.rpm:g} rpm")
+    if not todo:
+        return 0
+
+    started = time.monotonic()
+    results, usage = asyncio.run(_run(args, todo, units))
+    _print_report(results, len(items) - len(todo), time.monotonic() - started, usage)
+    print(f"results appended to {args.out}")
+    return 0 if all(r["ok"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""
+存储后端基准 — 合成用户 + 长历史，逐个后端测 load / append / save 的延迟与字节数。
+
+用法：
+    python scripts/bench_storage.py
+    python scripts/bench_storage.py --backends file,sqlite --users 50 --history 10,200,2000 --rounds 20
+
+- 数据写入临时目录（PROGRESS_DATA_DIR），不会触碰 data/
+- 每个历史长度先用事件灌入合成历史（不计时），再测 rounds 轮「加载 + 一次 quiz 的增量保存」，
+  最后每位用户一次整文档保存
+- s3：已设置 S3_BUCKET 时直接使用（可用 S3_ENDPOINT_URL 指向 MinIO 等本地替身）；
+  否则装有 moto 时自动启动进程内 moto server，都没有则跳过
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+BACKENDS = ("file", "eventlog", "sqlite", "s3")
+SEED_BATCH = 50          # 灌入历史时每批事件数（模拟一次次会话）
+
+
+# ---------------------------------------------------------------------------
+# 合成数据
+# ---------------------------------------------------------------------------
+def _quiz_events(make_event, rng: random.Random, ts: float) -> list[dict]:
+    """一次 quiz 评分产生的事件：1 次分数 + 若干弱点增减。"""
+    unit = rng.randint(1, 12)
+    events = [make_event("quiz_graded", ts, unit=unit, pct=rng.randint(20, 100))]
+    for _ in range(rng.randint(2, 8)):
+        key = f"mot-{rng.randint(1, 60)}"
+        if rng.random() < 0.6:
+            events.append(make_event(
+                "weak_point_added", ts, type="vocabulary", unit=unit, key=key,
+                item=f"Définition synthétique de {key}",
+            ))
+        else:
+            events.append(make_event("weak_point_reduced", ts, type="vocabulary", unit=unit, key=key))
+    return events
+
+
+def _seed(storage, make_event, user_id: str, history: int, rng: random.Random) -> float:
+    """灌入 history 次作答（约每小时一次），返回最后的时间戳。"""
+    ts = time.time() - history * 3600
+    batch: list[dict] = []
+    for _ in range(history):
+        batch.extend(_quiz_events(make_event, rng, ts))
+        ts += 3600
+        if len(batch) >= SEED_BATCH:
+            storage.append_events(user_id, batch)
+            batch = []
+    if batch:
+        storage.append_events(user_id, batch)
+    if rng.random() < 0.5:
+        storage.record_exam(user_id, "exam_blanc", ts, vocab_score=12, grammar_score=9)
+    return ts
+
+
+# ---------------------------------------------------------------------------
+# S3 本地替身
+# ---------------------------------------------------------------------------
+def _ensure_s3() -> bool:
+    if os.environ.get("S3_BUCKET"):
+        return True
+    try:
+        import boto3
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        return False
+    server = ThreadedMotoServer(port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    os.environ.update({
+        "S3_BUCKET": "vibe-francais-bench",
+        "S3_ENDPOINT_URL": f"http://{host}:{port}",
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+        "AWS_DEFAULT_REGION": "us-east-1",
+    })
+    boto3.client("s3", endpoint_url=os.environ["S3_ENDPOINT_URL"]).create_bucket(
+        Bucket=os.environ["S3_BUCKET"],
+    )
+    return True
+
+
+# ---------------------------------------------------------------------------
+# 报告
+# ---------------------------------------------------------------------------
+def _dir_bytes(*paths: Path) -> int:
+    total = 0
+    for p in paths:
+        if p.is_file():
+            total += p.stat().st_size
+        elif p.is_dir():
+            total += sum(f.stat().st_size for f in p.rglob("*") if f.is_file())
+    return total
+
+
+def _print_table(title: str, metrics: dict) -> None:
+    print(f"\n{title}")
+    print(f"  {'backend':<9} {'op':<8} {'n':>6} {'mean':>8} {'p50':>8} {'p95':>8} "
+          f"{'p99':>8} {'max':>8} {'B/op':>8} {'err':>4}")
+    for backend, ops in metrics.items():
+        for op, m in ops.items():
+            per_op = m["bytes"] // m["count"] if m["count"] else 0
+            print(f"  {backend:<9} {op:<8} {m['count']:>6} {m['mean_ms']:>8.2f} {m['p50_ms']:>8.2f} "
+                  f"{m['p95_ms']:>8.2f} {m['p99_ms']:>8.2f} {m['max_ms']:>8.2f} "
+                  f"{per_op:>8} {m['errors']:>4}")
+
+
+# ---------------------------------------------------------------------------
+# 主流程
+# ---------------------------------------------------------------------------
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--history", default="10,200,2000", help="每位用户的历史作答次数，逗号分隔")
+    parser.add_argument("--rounds", type=int, default=10, help="每位用户的加载 + 保存轮数")
+    parser.add_argument("--write-behind", action="store_true",
+                        help="保留文件后端的写后缓冲（默认关闭，测真实落盘）")
+    parser.add_argument("--json", type=Path, help="把全部指标另存为 JSON")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    data_dir = Path(tempfile.mkdtemp(prefix="vibe-bench-"))
+    os.environ["PROGRESS_DATA_DIR"] = str(data_dir)
+    os.environ.pop("SQLITE_PATH", None)
+    if not args.write_behind:
+        os.environ["FILE_WRITE_BEHIND_MS"] = "0"
+
+    # 环境变量设置完毕后再导入
+    from lib.progress import make_event
+    from lib.storage import (
+        _file_storage,
+        get_storage,
+        load_saved_progress,
+        reset_storage_metrics,
+        save_changes,
+        storage_metrics,
+    )
+
+    footprint = {
+        "file": (data_dir / "progress",),
+        "eventlog": (data_dir / "events",),
+        "sqlite": tuple(data_dir.glob("progress.db*")),
+    }
+    rng = random.Random(args.seed)
+    results: dict[str, dict] = {}
+    print(f"data dir: {data_dir}")
+
+    for backend in args.backends.split(","):
+        if backend == "s3" and not _ensure_s3():
+            print("\n[s3] skipped: set S3_BUCKET (and S3_ENDPOINT_URL) or install moto")
+            continue
+        os.environ["STORAGE_BACKEND"] = backend
+        storage = get_storage()
+        if storage.name != backend:
+            print(f"\n[{backend}] skipped: backend unavailable, got {storage.name}")
+            continue
+
+        for history in (int(h) for h in args.history.split(",")):
+            users = [f"bench-{backend}-h{history}-{i}" for i in range(args.users)]
+            t0 = time.perf_counter()
+            last_ts = {u: _seed(storage, make_event, u, history, rng) for u in users}
+            if backend == "file":
+                _file_storage.flush()
+            seed_s = time.perf_counter() - t0
+
+            reset_storage_metrics()
+            for _ in range(args.rounds):
+                for u in users:
+                    load_saved_progress(u)
+                    last_ts[u] += 3600
+                    save_changes(u, _quiz_events(make_event, rng, last_ts[u]))
+            for u in users:
+                storage.save_progress(u, storage.load_progress(u))
+            if backend == "file":
+                _file_storage.flush()
+
+            metrics = storage_metrics()
+            key = f"{backend}/h{history}"
+            results[key] = {
+                "seed_seconds": round(seed_s, 3),
+                "metrics": metrics,
+                "backend_metrics": storage.metrics(),
+            }
+            _print_table(
+                f"[{backend}] history={history} users={args.users} rounds={args.rounds} "
+                f"(seeded in {seed_s:.1f}s)",
+                metrics,
+            )
+            if storage.metrics():
+                print(f"  backend counters: {storage.metrics()}")
+
+        footprint["sqlite"] = tuple(data_dir.glob("progress.db*"))
+        if backend in footprint:
+            size = _dir_bytes(*footprint[backend])
+            results.setdefault(backend, {})["disk_bytes"] = size
+            print(f"  on disk: {size / 1024:.1f} KiB")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"\nmetrics written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,11 +12,12 @@ import streamlit as st
 import streamlit.components.v1 as components
 
 from lib.components import render_accent_bar, render_word_counter
-from lib.grading import grade_exam_blanc_writing
+from lib.grading import RUBRICS, stream_grade_exam_blanc_writing
 from lib.matching import match_answer, match_vocab_answer
+from lib.persistence import enqueue_changes
 from lib.prompts import EXAM_WRITING_PROMPTS
 from lib.quiz import generate_exam_blanc
-from lib.storage import save_scores
+from lib.state import drain_events, record_exam
 
 
 # ---------------------------------------------------------------------------
@@ -82,12 +83,18 @@ def _force_submit_exam(exam: dict, units: list[dict]) -> None:
     # -- AI 写作评分 --
     writing_text = st.session_state.get("eb_writing", "").strip()
     if writing_text and len(writing_text.split()) >= 30:
-        with st.spinner("Évaluation de la production écrite\u2026"):
-            grade = grade_exam_blanc_writing(writing_text, exam["writing_prompt"])
-        st.session_state.exam_blanc_writing_grade = grade
+        # 流式显示评语，结束后 rerun 进入结果页
+        stream = stream_grade_exam_blanc_writing(writing_text, exam["writing_prompt"])
+        with st.expander("Production Écrite -- évaluation en cours\u2026", expanded=True):
+            grade = st.write_stream(stream)
+        st.session_state.exam_blanc_writing_grade = grade or None
+        st.session_state.exam_blanc_results["writing"] = stream.rubric or _scan_writing_total(grade)
 
-    # -- 持久化分数 --
-    save_scores(st.session_state.scores, st.session_state.weak_points)
+    # -- 持久化分数（后台线程写入） --
+    writing = st.session_state.exam_blanc_results.get("writing")
+    scores = {"writing": writing} if writing else {}
+    record_exam("exam_blanc", vocab_score=vocab_score, grammar_score=grammar_score, **scores)
+    enqueue_changes(st.session_state.user_id, drain_events())
 
 
 # ---------------------------------------------------------------------------
@@ -262,25 +269,25 @@ def _render_exam_form(exam: dict, units: list[dict]) -> None:
         st.rerun()
 
 
+def _scan_writing_total(grade: str | None) -> dict | None:
+    """评语末尾没有结构化分数行时，退回从评语正文里找「xx/50」；找不到返回 None（不按 0 分计）。"""
+    matches = re.findall(r"(\d+(?:[.,]\d+)?)\s*/\s*50\b", grade or "")
+    if not matches:
+        return None
+    total = min(float(matches[-1].replace(",", ".")), 50)
+    return {"criteria": [], "total": int(total) if total.is_integer() else total, "max": 50}
+
+
 def _render_results(exam: dict) -> None:
     """展示考试结果。"""
     results = st.session_state.exam_blanc_results
     vocab_score = results["vocab_score"]
     grammar_score = results["grammar_score"]
 
-    # 从 AI 回复中提取写作分数
-    writing_score = 0
+    # 写作分数来自结构化评分（或评语正文中的总分）；都没有时标记为缺失，不按 0 分计入总分
+    writing = results.get("writing")
     writing_grade = st.session_state.exam_blanc_writing_grade
-    if writing_grade:
-        m = re.search(r"SCORE_TOTAL:\s*(\d+)/50", writing_grade)
-        if m:
-            writing_score = min(int(m.group(1)), 50)
-        else:
-            m = re.search(r"(\d+)\s*/\s*50", writing_grade)
-            if m:
-                writing_score = min(int(m.group(1)), 50)
-
-    total_score = round(vocab_score + grammar_score + writing_score, 1)
+    writing_score = writing["total"] if writing else None
 
     st.markdown("---")
     st.markdown("### Résultats")
@@ -288,8 +295,17 @@ def _render_results(exam: dict) -> None:
     c1, c2, c3, c4 = st.columns(4)
     c1.metric("Lexique", f"{vocab_score}/25")
     c2.metric("Grammaire", f"{grammar_score}/25")
-    c3.metric("Écriture", f"{writing_score}/50")
-    c4.metric("TOTAL", f"{total_score}/100")
+    if writing_score is not None:
+        c3.metric("Écriture", f"{writing_score}/50")
+        c4.metric("TOTAL", f"{round(vocab_score + grammar_score + writing_score, 1)}/100")
+    else:
+        c3.metric("Écriture", "--/50")
+        c4.metric("TOTAL", f"{round(vocab_score + grammar_score, 1)}/50")
+        if writing_grade:
+            st.warning(
+                "La note de production écrite n'a pas pu être lue : "
+                "le total ne porte que sur le lexique et la grammaire."
+            )
 
     # 词汇详情
     vc = sum(1 for r in results["vocab"] if r["correct"])
@@ -320,9 +336,14 @@ def _render_results(exam: dict) -> None:
 
     # 写作评分
     if writing_grade:
-        display_grade = re.sub(r"\n?SCORE_TOTAL:.*", "", writing_grade).strip()
-        with st.expander(f"Production Écrite -- {writing_score}/50", expanded=True):
-            st.markdown(display_grade)
+        label = f"{writing_score}/50" if writing_score is not None else "note indisponible"
+        with st.expander(f"Production Écrite -- {label}", expanded=True):
+            if writing and writing["criteria"]:
+                st.markdown(" \u00b7 ".join(
+                    f"{name} : {score}/{top}"
+                    for (name, top), score in zip(RUBRICS["exam_writing"], writing["criteria"])
+                ))
+            st.markdown(writing_grade)
     elif results.get("writing_text", "").strip():
         st.info("Production écrite trop courte pour être évaluée (minimum 30 mots).")
 
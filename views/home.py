@@ -15,11 +15,10 @@ from lib.state import reset_unit_state
 def render_home(units: list[dict]) -> None:
     """渲染首页：顶部 4 个 metric + 12 个单元卡片（2 列网格）。"""
 
-    scores = st.session_state.scores
-    total_quizzes = sum(len(v) for v in scores.values())
-    all_scores = [s for v in scores.values() for s in v]
-    avg_score = round(sum(all_scores) / max(total_quizzes, 1)) if total_quizzes else 0
-    units_done = len(scores)
+    stats = st.session_state.progress_stats
+    total_quizzes = stats.count
+    avg_score = stats.avg
+    units_done = stats.units_done
     wp_count = len(st.session_state.weak_points)
 
     st.caption("Édito B2 -- Cahier d'exercices dynamique")
@@ -43,10 +42,11 @@ def render_home(units: list[dict]) -> None:
 
             # 最高分标注
             best_score_html = ""
-            if n in scores:
+            best = stats.best(n)
+            if best is not None:
                 best_score_html = (
                     f'<div style="font-size:0.78rem; color:#007AFF; margin-top:0.15rem;">'
-                    f"Meilleur : {max(scores[n])}%</div>"
+                    f"Meilleur : {best}%</div>"
                 )
 
             grammar_text = ", ".join(u["grammar_focus"][:2])
@@ -4,8 +4,13 @@
 
 from __future__ import annotations
 
+from datetime import date, timedelta
+from itertools import islice
+
 import streamlit as st
 
+from lib.progress import skill_scores
+
 
 # ---------------------------------------------------------------------------
 # 进度页渲染
@@ -16,14 +21,13 @@ def render_progress() -> None:
 
     st.title("Tableau de Bord")
 
-    scores = st.session_state.scores
+    stats = st.session_state.progress_stats
     weak = st.session_state.weak_points
 
-    # -- 基础指标计算 --
-    total_quizzes = sum(len(v) for v in scores.values())
-    all_scores = [s for v in scores.values() for s in v]
-    avg_score = round(sum(all_scores) / max(total_quizzes, 1)) if total_quizzes else 0
-    units_done = len(scores)
+    # -- 基础指标（写入时增量维护，见 ProgressStats） --
+    total_quizzes = stats.count
+    avg_score = stats.avg
+    units_done = stats.units_done
 
     # -- B2 进度公式：40 + (Current_B2_Progress * 0.6) --
     # Current_B2_Progress = 覆盖率(50%) + 平均分(50%)，范围 0-100
@@ -33,8 +37,8 @@ def render_progress() -> None:
     readiness_pct = round(40 + current_b2_progress * 0.6, 1)
 
     # -- 雷达维度 (0-10) --
-    vocab_wps = sum(1 for w in weak if w.get("type") == "vocabulary")
-    gram_wps = sum(1 for w in weak if w.get("type") == "grammar")
+    vocab_wps = weak.count_type("vocabulary")
+    gram_wps = weak.count_type("grammar")
 
     if total_quizzes:
         base = avg_score / 10  # 0-10
@@ -45,10 +49,20 @@ def render_progress() -> None:
     else:
         vocab_score = grammar_score = oral_score = writing_score = 0
 
+    # 口语 / 写作：有 AI 评分记录时用真实得分率，否则沿用 quiz 估算
+    skills = skill_scores(st.session_state.exams)
+    if skills["oral"] is not None:
+        oral_score = round(skills["oral"] * 10, 1)
+    if skills["writing"] is not None:
+        writing_score = round(skills["writing"] * 10, 1)
+
     # -- 顶部指标行 --
     c1, c2, c3, c4 = st.columns(4)
     c1.metric("Quiz complétés", total_quizzes)
-    c2.metric("Score moyen", f"{avg_score}%" if total_quizzes else "--")
+    c2.metric(
+        "Score moyen", f"{avg_score}%" if total_quizzes else "--",
+        delta=f"{stats.recent_avg - avg_score:+d} ({stats.WINDOW} derniers)" if total_quizzes else None,
+    )
     c3.metric("Unités", f"{units_done}/12")
     c4.metric("Points faibles", len(weak))
 
@@ -191,7 +205,41 @@ def render_progress() -> None:
         )
         st.plotly_chart(fig_radar, use_container_width=True, config={"displayModeBar": False})
 
-    # -- 3. Weak Points — Top 3 --
+    # -- 3. 长期趋势（日 / 周汇总 + 最近明细） --
+    trend = st.session_state.score_history.trend()
+    if len(trend) >= 2:
+        epoch = date(1970, 1, 1)
+        xs = [epoch + timedelta(days=day) for day, _c, _m, _b in trend]
+        fig_trend = go.Figure()
+        fig_trend.add_trace(go.Scatter(
+            x=xs, y=[m for _d, _c, m, _b in trend],
+            mode="lines+markers",
+            line={"color": "#007AFF", "width": 2.5},
+            marker={"size": 6, "color": "#007AFF"},
+            name="Moyenne",
+            customdata=[[c, b] for _d, c, _m, b in trend],
+            hovertemplate="%{x|%d/%m/%Y} · %{y}% · %{customdata[0]} quiz · max %{customdata[1]}%<extra></extra>",
+        ))
+        fig_trend.update_layout(
+            title={
+                "text": "Évolution", "x": 0.5, "xanchor": "center",
+                "font": {
+                    "size": 16, "color": "#1D1D1F",
+                    "family": "Inter, -apple-system, sans-serif", "weight": 600,
+                },
+            },
+            yaxis={"range": [0, 100], "ticksuffix": "%", "gridcolor": "#E5E5EA"},
+            xaxis={"gridcolor": "#E5E5EA"},
+            showlegend=False,
+            height=280,
+            margin={"l": 40, "r": 30, "t": 60, "b": 30},
+            paper_bgcolor="rgba(0,0,0,0)",
+            plot_bgcolor="rgba(0,0,0,0)",
+            font={"family": "Inter, -apple-system, sans-serif"},
+        )
+        st.plotly_chart(fig_trend, use_container_width=True, config={"displayModeBar": False})
+
+    # -- 4. Weak Points — Top 3 --
     st.markdown("---")
     st.markdown("##### Points faibles")
 
@@ -202,7 +250,7 @@ def render_progress() -> None:
             "expression": ("Expression", "wp-expr"),
             "conjugation": ("Conjugaison", "wp-expr"),
         }
-        for wp in weak[:3]:
+        for wp in islice(weak, 3):
             label, css_cls = _type_map.get(wp.get("type", ""), ("Autre", "wp-other"))
 
             # 失败次数标注
@@ -0,0 +1,73 @@
+"""
+检索页 — 在全部单元语料中查找词汇、表达和例句，并跳转到所属单元。
+"""
+
+from __future__ import annotations
+
+import time
+
+import streamlit as st
+
+from lib.search import SearchIndex
+from lib.state import reset_unit_state
+
+
+_KIND_LABELS = {
+    "vocabulary": ("Vocabulaire", "wp-vocab"),
+    "vocabulary_list": ("Lexique", "wp-vocab"),
+    "expression": ("Expression", "wp-expr"),
+    "grammar": ("Grammaire", "wp-gram"),
+}
+
+
+# ---------------------------------------------------------------------------
+# 检索页渲染
+# ---------------------------------------------------------------------------
+def render_search(units: list[dict], index: SearchIndex) -> None:
+    """渲染检索框和结果列表。"""
+    st.title("Recherche")
+    st.caption("Vocabulaire · Expressions · Exemples · Transformations -- accents facultatifs")
+
+    query = st.text_input(
+        "Recherche", key="search_query",
+        placeholder="ex. force est de constater",
+        label_visibility="collapsed",
+    )
+    if not query.strip():
+        return
+
+    t0 = time.perf_counter()
+    hits = index.search(query)
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+
+    st.caption(f"{len(hits)} résultat(s) · {elapsed_ms:.1f} ms")
+    if not hits:
+        st.info("Aucun résultat.")
+        return
+
+    themes = {u["unit_number"]: u["theme"] for u in units}
+    for i, hit in enumerate(hits):
+        label, css_cls = _KIND_LABELS.get(hit.kind, ("Autre", "wp-other"))
+        detail_html = (
+            f'<br><span style="font-size:0.8rem;color:#8E8E93;">{hit.detail}</span>'
+            if hit.detail else ""
+        )
+        text_col, btn_col = st.columns([5, 1])
+        with text_col:
+            st.markdown(
+                f'<div class="weak-point-item">'
+                f'<span class="wp-badge {css_cls}">{label}</span>'
+                f'<span class="wp-text">{hit.title}{detail_html}</span>'
+                f'<span class="wp-unit">U{hit.unit}</span>'
+                f"</div>",
+                unsafe_allow_html=True,
+            )
+        with btn_col:
+            if st.button(
+                f"Unité {hit.unit}", key=f"search_hit_{i}",
+                help=themes.get(hit.unit, ""), use_container_width=True,
+            ):
+                st.session_state.current_page = "unit"
+                st.session_state.current_unit = hit.unit
+                reset_unit_state()
+                st.rerun()
@@ -4,16 +4,19 @@
 
 from __future__ import annotations
 
+import hashlib
 import re
 
 import streamlit as st
 
 from lib.components import render_accent_bar, render_word_counter
+from lib import exam_bank
 from lib.grading import (
     generate_exam_ce,
     generate_exam_co,
-    grade_oral,
-    grade_writing,
+    get_api_key,
+    stream_grade_oral,
+    stream_grade_writing,
 )
 from lib.matching import match_answer, match_conj_answer, match_expr_answer, match_vocab_answer
 from lib.prompts import (
@@ -22,9 +25,16 @@ from lib.prompts import (
     ORAL_PROMPTS,
     WRITING_PROMPTS,
 )
+from lib.persistence import enqueue_changes
 from lib.quiz import generate_unit_quiz
-from lib.state import add_weak_point, reduce_weak_point
-from lib.storage import save_scores
+from lib.state import (
+    add_weak_point,
+    drain_events,
+    get_weak_items_for_unit,
+    record_exam,
+    record_score,
+    reduce_weak_point,
+)
 from lib.tts import tts_french
 
 
@@ -36,6 +46,23 @@ def get_unit(units: list[dict], n: int) -> dict | None:
     return next((u for u in units if u["unit_number"] == n), None)
 
 
+def _record_rubric(kind: str, rubric: dict | None, unit: dict, text: str) -> None:
+    """
+    评语流结束后，把结构化分数记入进度（后台线程写入）。
+
+    同一文本再点「Évaluer」会重放缓存的评语；按 (kind, 单元, 文本) 的摘要去重，
+    避免同一份作答被重复计入 skill_scores。
+    """
+    if not rubric:
+        return
+    key = f"{kind}\n{unit['unit_number']}\n{text.strip()}"
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+    if any(e.get("submission") == digest for e in st.session_state.exams):
+        return
+    record_exam(kind, unit=unit["unit_number"], submission=digest, **rubric)
+    enqueue_changes(st.session_state.user_id, drain_events())
+
+
 # ---------------------------------------------------------------------------
 # 单元页入口
 # ---------------------------------------------------------------------------
@@ -71,7 +98,9 @@ def _render_quiz(unit: dict, units: list[dict]) -> None:
 
     # -- 生成题目 --
     if not st.session_state.quiz_questions:
-        quiz = generate_unit_quiz(unit, units, st.session_state.weak_points)
+        quiz = generate_unit_quiz(
+            unit, units, get_weak_items_for_unit(unit["unit_number"]),
+        )
         nv = len(quiz["vocab"])
         ne = len(quiz["expr"])
         nc = len(quiz["conj"])
@@ -249,13 +278,10 @@ def _grade_quiz(
     st.session_state.quiz_submitted = True
     st.session_state.quiz_results = results
 
-    unit_num = unit["unit_number"]
-    if unit_num not in st.session_state.scores:
-        st.session_state.scores[unit_num] = []
-    st.session_state.scores[unit_num].append(pct)
+    record_score(unit["unit_number"], pct)
 
-    # 持久化
-    save_scores(st.session_state.scores, st.session_state.weak_points)
+    # 持久化（后台线程写入，不阻塞结果展示）
+    enqueue_changes(st.session_state.user_id, drain_events())
     st.rerun()
 
 
@@ -355,14 +381,18 @@ def _render_oral(unit: dict) -> None:
             "Évaluer", type="primary", use_container_width=True,
         )
 
+    streamed = False
     if oral_submitted and oral_text.strip():
-        with st.spinner("Évaluation en cours\u2026"):
-            grade = grade_oral(oral_text, unit)
-        if grade:
+        # 流式渲染：首个 token 到达即开始显示；中途失败时不覆盖之前的评语
+        stream = stream_grade_oral(oral_text, unit)
+        with st.expander("Évaluation orale", expanded=True):
+            grade = st.write_stream(stream)
+        if grade and stream.complete:
+            streamed = True
             st.session_state.oral_grade = grade
+            _record_rubric("oral", stream.rubric, unit, oral_text)
             st.toast("Évaluation terminée !")
-
-    if st.session_state.oral_grade:
+    if st.session_state.oral_grade and not streamed:
         with st.expander("Évaluation orale", expanded=True):
             st.markdown(st.session_state.oral_grade)
 
@@ -399,6 +429,7 @@ def _render_writing(unit: dict) -> None:
 
     render_word_counter(user_text)
 
+    streamed = False
     if user_text.strip() and st.button(
         "Évaluer", type="primary", key=f"eval_writing_{unit['unit_number']}",
     ):
@@ -406,13 +437,17 @@ def _render_writing(unit: dict) -> None:
         if word_count < 50:
             st.warning("Texte trop court -- visez au moins 250 mots.")
         else:
-            with st.spinner("Évaluation en cours\u2026"):
-                grade = grade_writing(user_text, unit)
-            if grade:
+            # 流式渲染：首个 token 到达即开始显示
+            stream = stream_grade_writing(user_text, unit)
+            with st.expander("Évaluation écrite", expanded=True):
+                grade = st.write_stream(stream)
+            if grade and stream.complete:
+                streamed = True
                 st.session_state.writing_grade = grade
+                _record_rubric("writing", stream.rubric, unit, user_text)
                 st.toast("Évaluation terminée !")
 
-    if st.session_state.writing_grade:
+    if st.session_state.writing_grade and not streamed:
         with st.expander("Évaluation écrite", expanded=True):
             st.markdown(st.session_state.writing_grade)
 
@@ -451,6 +486,31 @@ def _render_exam(unit: dict) -> None:
 
     st.markdown("---")
 
+    api_key = get_api_key()
+
+    # 一键准备：CO / CE 生成与 CO 语音合成并发进行
+    missing = tuple(k for k in exam_bank.KINDS if st.session_state[f"exam_{k}_data"] is None)
+    if missing and st.button("Préparer l'examen", type="primary", key="prepare_exam"):
+        if not api_key:
+            st.warning("请先在侧边栏输入 OpenRouter API Key。")
+        else:
+            with st.spinner("Préparation des épreuves CO et CE…"):
+                prepared = exam_bank.prepare_exam(
+                    unit, st.session_state.user_id, api_key, missing,
+                )
+            for err in prepared["errors"]:
+                st.error(err)
+            for kind in missing:
+                if prepared[kind] is not None:
+                    st.session_state[f"exam_{kind}_data"] = prepared[kind]
+                    st.session_state[f"exam_{kind}_submitted"] = False
+                    st.session_state[f"exam_{kind}_score"] = None
+                    exam_bank.request_refill(unit, kind, st.session_state.user_id)
+            if prepared["co"] is not None:
+                st.session_state.exam_co_audio = prepared["audio"]
+            if not prepared["errors"]:
+                st.rerun()
+
     # -- 1. CO --
     _render_exam_co(unit)
     st.markdown("---")
@@ -475,16 +535,31 @@ def _render_exam_co(unit: dict) -> None:
     st.markdown("#### 1. Compréhension de l'oral")
 
     if st.session_state.exam_co_data is None:
+        user_id = st.session_state.user_id
+        ready = exam_bank.available(unit["unit_number"], "co", user_id)
         if st.button("Générer l'épreuve CO", type="primary", key="gen_co"):
-            with st.spinner("Génération du document sonore\u2026"):
-                data = generate_exam_co(unit)
+            banked = exam_bank.take(unit["unit_number"], "co", user_id)
+            if banked:
+                data, audio = banked
+            else:
+                # 题库暂无可用题：现场生成，并存入题库（记为已发放）
+                with st.spinner("Génération du document sonore\u2026"):
+                    data = generate_exam_co(unit)
+                audio = None
+                if data:
+                    with st.spinner("Synthèse vocale\u2026"):
+                        audio = tts_french(data["transcript"])
+                    exam_bank.add(unit["unit_number"], "co", data, audio, served_to=user_id)
             if data:
+                # 后台补充题库：下次点「Générer」时直接从题库出题
+                exam_bank.request_refill(unit, "co", user_id)
                 st.session_state.exam_co_data = data
                 st.session_state.exam_co_submitted = False
                 st.session_state.exam_co_score = None
-                with st.spinner("Synthèse vocale\u2026"):
-                    st.session_state.exam_co_audio = tts_french(data["transcript"])
+                st.session_state.exam_co_audio = audio
                 st.rerun()
+        if ready:
+            st.caption(f"{ready} épreuve(s) prête(s)")
         return
 
     co = st.session_state.exam_co_data
@@ -546,14 +621,25 @@ def _render_exam_ce(unit: dict) -> None:
     st.markdown("#### 2. Compréhension des écrits")
 
     if st.session_state.exam_ce_data is None:
+        user_id = st.session_state.user_id
+        ready = exam_bank.available(unit["unit_number"], "ce", user_id)
         if st.button("Générer l'épreuve CE", type="primary", key="gen_ce"):
-            with st.spinner("Génération de la compréhension écrite\u2026"):
-                data = generate_exam_ce(unit)
+            banked = exam_bank.take(unit["unit_number"], "ce", user_id)
+            if banked:
+                data = banked[0]
+            else:
+                with st.spinner("Génération de la compréhension écrite\u2026"):
+                    data = generate_exam_ce(unit)
+                if data:
+                    exam_bank.add(unit["unit_number"], "ce", data, served_to=user_id)
             if data:
+                exam_bank.request_refill(unit, "ce", user_id)
                 st.session_state.exam_ce_data = data
                 st.session_state.exam_ce_submitted = False
                 st.session_state.exam_ce_score = None
                 st.rerun()
+        if ready:
+            st.caption(f"{ready} épreuve(s) prête(s)")
         return
 
     ce = st.session_state.exam_ce_data
@@ -621,14 +707,17 @@ def _render_exam_pe(unit: dict) -> None:
             "Évaluer la PE", type="primary", use_container_width=True,
         )
 
+    streamed = False
     if pe_submitted and exam_pe_text.strip():
-        with st.spinner("Évaluation\u2026"):
-            grade = grade_writing(exam_pe_text, unit)
-        if grade:
+        stream = stream_grade_writing(exam_pe_text, unit)
+        with st.expander("Évaluation PE", expanded=True):
+            grade = st.write_stream(stream)
+        if grade and stream.complete:
+            streamed = True
             st.session_state.exam_pe_grade = grade
+            _record_rubric("exam_pe", stream.rubric, unit, exam_pe_text)
             st.toast("PE évaluée !")
-
-    if st.session_state.exam_pe_grade:
+    if st.session_state.exam_pe_grade and not streamed:
         with st.expander("Évaluation PE", expanded=True):
             st.markdown(st.session_state.exam_pe_grade)
 
@@ -661,13 +750,16 @@ def _render_exam_po(unit: dict) -> None:
             "Évaluer la PO", type="primary", use_container_width=True,
         )
 
+    streamed = False
     if po_submitted and exam_po_text.strip():
-        with st.spinner("Évaluation\u2026"):
-            grade = grade_oral(exam_po_text, unit)
-        if grade:
+        stream = stream_grade_oral(exam_po_text, unit)
+        with st.expander("Évaluation PO", expanded=True):
+            grade = st.write_stream(stream)
+        if grade and stream.complete:
+            streamed = True
             st.session_state.exam_po_grade = grade
+            _record_rubric("exam_po", stream.rubric, unit, exam_po_text)
             st.toast("PO évaluée !")
-
-    if st.session_state.exam_po_grade:
+    if st.session_state.exam_po_grade and not streamed:
         with st.expander("Évaluation PO", expanded=True):
             st.markdown(st.session_state.exam_po_grade)